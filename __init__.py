@@ -1,14 +1,25 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
 from trytond.pool import Pool
-from . import stock
+from . import inventory, ir, journal, lot, package, product, stock, total
 
 
 def register():
     Pool.register(
+        inventory.Inventory,
+        ir.Cron,
+        journal.ScannerLotJournal,
+        lot.Lot,
+        package.ScannerLotPackage,
+        package.ScannerLotPackageLine,
+        product.Template,
         stock.Configuration,
         stock.ConfigurationScannerLotCreation,
         stock.ShipmentIn,
+        stock.ShipmentInReturn,
+        stock.ShipmentInternal,
         stock.ShipmentOut,
         stock.ShipmentOutReturn,
+        stock.Move,
+        total.ScannerLotTotal,
         module='stock_scanner_lot', type_='model')
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+"""
+Benchmark of the GS1 parser on synthetic barcodes.
+
+Usage: python benchmarks/gs1.py [number of codes]
+"""
+import random
+import sys
+import time
+
+from trytond.modules.stock_scanner_lot.gs1 import GS, parse
+
+
+def generate(count):
+    generator = random.Random(0)
+    codes = []
+    for i in range(count):
+        code = '01%014d17%02d%02d%02d10L%d' % (
+            generator.randrange(10 ** 13), generator.randrange(20, 40),
+            generator.randrange(1, 13), generator.randrange(1, 29), i)
+        if i % 2:
+            code += GS + '30%d' % generator.randrange(1, 1000)
+        else:
+            code = '(01)%s(10)%s(37)%d' % (
+                code[2:16], code[26:], generator.randrange(1, 100))
+        codes.append(code)
+    return codes
+
+
+def main(count):
+    codes = generate(count)
+    start = time.perf_counter()
+    for code in codes:
+        parse(code)
+    duration = time.perf_counter() - start
+    print('%d codes: %.2f µs/code' % (count, duration / count * 1e6))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+"""
+Benchmark of the lot lookups done by the scanner on a generated stock_lot
+table without indexes and with the indexes of the stock.lot model.
+
+The lookups are the ones of the module: get_scanner_lot by product and number
+and match_scanner_lots with the prefix strategy, which runs the exact, the
+normalized and the prefix queries. The indexes are created by the table
+handler of the backend from the indexes of the model, so on SQLite the indexes
+with parameters or similarity usage are not created as in production.
+
+The database is set like for the tests with the TRYTOND_DATABASE_URI and
+DB_NAME environment variables.
+
+Usage: python benchmarks/lot_index.py [number of lots]
+"""
+import datetime
+import random
+import sys
+import time
+from decimal import Decimal
+
+from trytond import backend
+from trytond.pool import Pool
+from trytond.tests.test_tryton import DB_NAME, USER, activate_module
+from trytond.tools import grouped_slice
+from trytond.transaction import Transaction
+
+PRODUCTS = 100
+
+
+def create_products(count):
+    pool = Pool()
+    Uom = pool.get('product.uom')
+    Template = pool.get('product.template')
+
+    unit, = Uom.search([('name', '=', 'Unit')])
+    templates = Template.create([{
+                'name': 'Product %s' % i,
+                'type': 'goods',
+                'default_uom': unit.id,
+                'list_price': Decimal(10),
+                'products': [('create', [{}])],
+                } for i in range(count)])
+    return [t.products[0] for t in templates]
+
+
+def generate(products, count):
+    "Insert the lots with SQL as the ORM would take too long"
+    pool = Pool()
+    Lot = pool.get('stock.lot')
+    transaction = Transaction()
+    cursor = transaction.connection.cursor()
+    lot = Lot.__table__()
+    now = datetime.datetime.now()
+    for sub_ids in grouped_slice(range(count), 1000):
+        cursor.execute(*lot.insert(
+                [lot.product, lot.number, lot.active, lot.create_uid,
+                    lot.create_date],
+                [[products[i % len(products)].id, 'L%08d' % i, True,
+                        transaction.user, now]
+                    for i in sub_ids]))
+
+
+def timed(func, params):
+    pool = Pool()
+    Lot = pool.get('stock.lot')
+    Lot._scanner_number_cache.clear()
+    start = time.perf_counter()
+    for param in params:
+        func(*param)
+    return (time.perf_counter() - start) / len(params) * 1e6
+
+
+def measure(lookups, prefixes):
+    pool = Pool()
+    Lot = pool.get('stock.lot')
+    cursor = Transaction().connection.cursor()
+    cursor.execute('ANALYZE')
+    return (
+        timed(Lot.get_scanner_lot, lookups),
+        timed(lambda p, n: Lot.match_scanner_lots(p, n, 'prefix'), prefixes))
+
+
+def main(count):
+    activate_module(['stock_scanner_lot'])
+    with Transaction().start(DB_NAME, USER, context={}) as transaction:
+        pool = Pool()
+        Lot = pool.get('stock.lot')
+        products = create_products(PRODUCTS)
+        generate(products, count)
+        lookups = [(products[i % PRODUCTS], 'L%08d' % i)
+            for i in random.sample(range(count), 200)]
+        # Beginnings of the numbers of 100 lots, one of each product
+        prefixes = [(products[i % PRODUCTS], 'L%06d' % (i // 100))
+            for i in random.sample(range(count), 200)]
+
+        table = backend.TableHandler(Lot)
+        print('%d lots' % count)
+        table.set_indexes(set())
+        print('  without index: %10.1f µs/lookup %10.1f µs/prefix' % (
+                measure(lookups, prefixes)))
+        table.set_indexes(Lot._sql_indexes)
+        print('  with index:    %10.1f µs/lookup %10.1f µs/prefix' % (
+                measure(lookups, prefixes)))
+        transaction.rollback()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+"""
+Micro-benchmark of the lookups done by the scanner on the move index of a
+shipment when the number of moves grows.
+
+Usage: python benchmarks/move_index.py
+"""
+import timeit
+
+from trytond.modules.stock_scanner_lot.stock import MoveIndex
+
+
+class Move(object):
+    __slots__ = ('product', 'lot', 'pending_quantity')
+
+    def __init__(self, product, lot, pending_quantity):
+        self.product = product
+        self.lot = lot
+        self.pending_quantity = pending_quantity
+
+
+def build(count):
+    moves = [Move(i % 50, i, 10) for i in range(count)]
+    moves += [Move(i % 50, i, 0) for i in range(count // 10)]
+    return MoveIndex(moves)
+
+
+def main():
+    number = 10000
+    for count in (10, 100, 500, 1000, 2000):
+        index = build(count)
+
+        def scan():
+            index.pending(7, 7)
+            index.not_pending(7, 7)
+        seconds = timeit.timeit(scan, number=number)
+        print('%5d moves: %8.2f µs/scan' % (count, seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
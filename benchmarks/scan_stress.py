@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+"""
+Concurrent scan stress test.
+
+It starts several threads scanning the same shipment with scan_batch, each
+scan in its own transaction retried like the dispatcher does up to the
+"retry" key of the [database] section of the trytond configuration, and
+checks at the end that the quantities are conserved: for each product the
+scanned quantity is the number of scans and the total quantity of the moves
+is the initial one or the scanned quantity when it is exceeded. The retries
+are reported as they show how much the scans are serialized, and the scans
+which still fail after the last retry are counted as lost.
+
+It must run on a database supporting concurrent transactions, for example
+with TRYTOND_DATABASE_URI=postgresql://.
+
+Usage:
+    python benchmarks/scan_stress.py --threads 8 --scans 50 --lines 5
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from trytond import backend
+from trytond.config import config
+from trytond.modules.company.tests import set_company
+from trytond.pool import Pool
+from trytond.tests.test_tryton import DB_NAME, USER, activate_module
+from trytond.transaction import Transaction, TransactionError
+
+from scan_throughput import create_products, create_shipment, setup
+
+
+def run(func, context, retried=None):
+    "Run func in a new transaction, retrying it like the dispatcher"
+    extras = {}
+    retry = config.getint('database', 'retry')
+    count = 0
+    while True:
+        try:
+            with Transaction().start(
+                    DB_NAME, USER, context=context, **extras):
+                return func()
+        except TransactionError as e:
+            e.fix(extras)
+        except backend.DatabaseOperationalError:
+            if count >= retry:
+                raise
+            count += 1
+            if retried is not None:
+                retried['retries'] += 1
+            time.sleep(random.random() * 0.02 * count)
+
+
+def scanner(model, shipment_id, product_lots, scans, context, seed, done):
+    generator = random.Random(seed)
+
+    def scan(product_id, lot_id):
+        pool = Pool()
+        Shipment = pool.get(model)
+        Lot = pool.get('stock.lot')
+        lot = Lot(lot_id)
+        scan = {
+            'product': product_id,
+            'quantity': 1,
+            'lot_number': lot.number,
+            }
+        if model != 'stock.shipment.in':
+            scan['lot'] = lot.id
+        # The batch does not write the shipment like the scan button
+        Shipment.scan_batch([Shipment(shipment_id)], [scan])
+
+    for _ in range(scans):
+        product_id = generator.choice(list(product_lots))
+        lot_id = generator.choice(product_lots[product_id])
+        try:
+            run(lambda: scan(product_id, lot_id), context, done)
+        except backend.DatabaseOperationalError:
+            done['lost'] += 1
+            continue
+        done[product_id] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--model', default='stock.shipment.in')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--scans', type=int, default=25,
+        help='number of scans per thread')
+    parser.add_argument('--lines', type=int, default=3)
+    parser.add_argument('--lots', type=int, default=3)
+    options = parser.parse_args()
+
+    activate_module(['stock_scanner_lot'])
+    with Transaction().start(DB_NAME, USER, context={}) as transaction:
+        parties = setup()
+        company = parties[0]
+        with set_company(company):
+            products = create_products(options.lines, options.lots)
+            shipment = create_shipment(
+                options.model, products, options.lots, *parties)
+            product_lots = {p.id: [] for p in products}
+            for lot in Pool().get('stock.lot').search([
+                        ('product', 'in', list(product_lots)),
+                        ]):
+                product_lots[lot.product.id].append(lot.id)
+            initial = {p.id: 10 * options.lots for p in products}
+            context = dict(Transaction().context)
+        shipment_id = shipment.id
+        transaction.commit()
+
+    counters = [Counter() for _ in range(options.threads)]
+    threads = [threading.Thread(target=scanner, args=(
+                options.model, shipment_id, product_lots, options.scans,
+                context, i, counters[i]))
+        for i in range(options.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    scanned = sum(counters, Counter())
+    retries, lost = scanned.pop('retries', 0), scanned.pop('lost', 0)
+
+    def totals():
+        pool = Pool()
+        Move = pool.get('stock.move')
+        quantities, scanned_quantities = defaultdict(int), defaultdict(int)
+        for move in Move.search([
+                    ('shipment', '=', '%s,%s' % (options.model, shipment_id)),
+                    ]):
+            quantities[move.product.id] += move.quantity
+            scanned_quantities[move.product.id] += move.scanned_quantity or 0
+        return quantities, scanned_quantities
+    quantities, scanned_quantities = run(totals, context)
+
+    errors = 0
+    for product_id, quantity in initial.items():
+        quantity = max(quantity, scanned[product_id])
+        if quantities[product_id] != quantity:
+            print("Product %s: quantity %s instead of %s" % (
+                    product_id, quantities[product_id], quantity))
+            errors += 1
+        if scanned_quantities[product_id] != scanned[product_id]:
+            print("Product %s: scanned %s instead of %s" % (
+                    product_id, scanned_quantities[product_id],
+                    scanned[product_id]))
+            errors += 1
+    total = sum(scanned.values())
+    print("%d scans by %d threads in %.2fs (%.1f scans/s)" % (
+            total, options.threads, duration, total / duration))
+    print("%d retries, %d scans lost after %d retries" % (
+            retries, lost, config.getint('database', 'retry')))
+    if errors:
+        sys.exit("Quantities are not conserved")
+    print("Quantities are conserved")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+"""
+Scan throughput benchmark.
+
+It generates shipments of N lines with M lots per product and drives the scan
+button on supplier, customer and customer return shipments for each lot
+creation mode, reporting the scans per second and the queries per scan.
+
+The database is set like for the tests with the TRYTOND_DATABASE_URI and
+DB_NAME environment variables, so it runs on SQLite by default and on
+PostgreSQL with for example TRYTOND_DATABASE_URI=postgresql://.
+
+Usage:
+    python benchmarks/scan_throughput.py --lines 10,100,1000 --lots 1,50 \\
+        --scans 200 --output results.json
+"""
+import argparse
+import datetime
+import json
+import random
+import time
+from decimal import Decimal
+
+from trytond.config import config
+
+if not config.has_section('stock_scanner_lot'):
+    config.add_section('stock_scanner_lot')
+config.set('stock_scanner_lot', 'instrumentation', 'True')
+
+from trytond.modules.company.tests import (  # noqa: E402
+    create_company, set_company)
+from trytond.modules.stock_scanner_lot import instrumentation  # noqa: E402
+from trytond.modules.stock_scanner_lot.stock import (  # noqa: E402
+    LOT_CREATION_MODES)
+from trytond.pool import Pool  # noqa: E402
+from trytond.tests.test_tryton import (  # noqa: E402
+    DB_NAME, USER, activate_module)
+from trytond.transaction import Transaction  # noqa: E402
+
+SHIPMENT_MODELS = [
+    'stock.shipment.in',
+    'stock.shipment.out',
+    'stock.shipment.out.return',
+    ]
+
+
+def setup():
+    pool = Pool()
+    Party = pool.get('party.party')
+    Config = pool.get('stock.configuration')
+
+    company = create_company()
+    supplier, customer = Party.create([
+            {'name': 'Supplier', 'addresses': [('create', [{}])]},
+            {'name': 'Customer', 'addresses': [('create', [{}])]},
+            ])
+    Config.write([Config(1)], {
+            f: True for f in [
+                'scanner_on_shipment_in',
+                'scanner_on_shipment_out',
+                'scanner_on_shipment_out_return',
+                ] if f in Config._fields})
+    return company, supplier, customer
+
+
+def create_products(lines, lots):
+    pool = Pool()
+    Uom = pool.get('product.uom')
+    Template = pool.get('product.template')
+    Lot = pool.get('stock.lot')
+
+    unit, = Uom.search([('name', '=', 'Unit')])
+    templates = Template.create([{
+                'name': 'Product %s' % i,
+                'type': 'goods',
+                'default_uom': unit.id,
+                'list_price': Decimal(10),
+                'products': [('create', [{}])],
+                } for i in range(lines)])
+    products = [t.products[0] for t in templates]
+    Lot.create([{
+                'product': p.id,
+                'number': '%s-%s' % (p.id, i),
+                } for p in products for i in range(lots)])
+    return products
+
+
+def create_shipment(model, products, lots, company, supplier, customer):
+    pool = Pool()
+    Location = pool.get('stock.location')
+    Move = pool.get('stock.move')
+    Shipment = pool.get(model)
+
+    warehouse, = Location.search([('code', '=', 'WH')])
+    supplier_loc, = Location.search([('code', '=', 'SUP')])
+    customer_loc, = Location.search([('code', '=', 'CUS')])
+    moves = []
+    for product in products:
+        move = Move(
+            product=product, unit=product.default_uom,
+            quantity=10 * lots, company=company,
+            unit_price=Decimal(1), currency=company.currency)
+        if model == 'stock.shipment.in':
+            move.from_location = supplier_loc
+            move.to_location = warehouse.input_location
+        elif model == 'stock.shipment.out':
+            move.from_location = warehouse.output_location
+            move.to_location = customer_loc
+        else:
+            move.from_location = customer_loc
+            move.to_location = warehouse.input_location
+        moves.append(move)
+    shipment = Shipment(company=company, warehouse=warehouse)
+    if model == 'stock.shipment.in':
+        shipment.supplier = supplier
+        shipment.incoming_moves = moves
+    elif model == 'stock.shipment.out':
+        shipment.customer = customer
+        shipment.outgoing_moves = moves
+    else:
+        shipment.customer = customer
+        shipment.incoming_moves = moves
+    shipment.save()
+    if model == 'stock.shipment.out':
+        Shipment.wait([shipment])
+    return shipment
+
+
+def run_case(model, mode, lines, lots, scans, parties):
+    pool = Pool()
+    Config = pool.get('stock.configuration')
+    Lot = pool.get('stock.lot')
+    Shipment = pool.get(model)
+    transaction = Transaction()
+
+    Config.write([Config(1)], {'scanner_lot_creation': mode})
+    products = create_products(lines, lots)
+    shipment = create_shipment(model, products, lots, *parties)
+    transaction.commit()
+
+    product_lots = {}
+    for lot in Lot.search([('product', 'in', [p.id for p in products])]):
+        product_lots.setdefault(lot.product, []).append(lot)
+    generator = random.Random(lines * 1000 + lots)
+    instrumentation.reset()
+    start = time.perf_counter()
+    for _ in range(scans):
+        product = generator.choice(products)
+        lot = generator.choice(product_lots[product])
+        shipment = Shipment(shipment.id)
+        shipment.scanned_product = product
+        shipment.scanned_quantity = 1
+        shipment.scanned_lot_number = lot.number
+        shipment.scanned_lot = lot if model != 'stock.shipment.in' else None
+        shipment.save()
+        Shipment.scan([shipment])
+        transaction.commit()
+    duration = time.perf_counter() - start
+
+    queries = None
+    for stat in instrumentation.statistics():
+        if stat['stage'] == 'scan':
+            queries = stat['queries_p50']
+    return {
+        'model': model,
+        'lot_creation': mode,
+        'lines': lines,
+        'lots': lots,
+        'scans': scans,
+        'seconds': duration,
+        'scans_per_second': scans / duration,
+        'queries_per_scan': queries,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--lines', default='10,100',
+        help='comma separated number of lines of the shipments')
+    parser.add_argument('--lots', default='1,10',
+        help='comma separated number of lots per product')
+    parser.add_argument('--scans', type=int, default=100,
+        help='number of scans per shipment')
+    parser.add_argument('--models', default=','.join(SHIPMENT_MODELS))
+    parser.add_argument('--output', help='JSON file to save the results')
+    options = parser.parse_args()
+
+    activate_module(['stock_scanner_lot'])
+    results = []
+    with Transaction().start(DB_NAME, USER, context={}) as transaction:
+        parties = setup()
+        with set_company(parties[0]):
+            for model in options.models.split(','):
+                for mode, _ in LOT_CREATION_MODES:
+                    for lines in map(int, options.lines.split(',')):
+                        for lots in map(int, options.lots.split(',')):
+                            result = run_case(model, mode, lines, lots,
+                                options.scans, parties)
+                            results.append(result)
+                            print('%(model)s %(lot_creation)s '
+                                '%(lines)d lines x %(lots)d lots: '
+                                '%(scans_per_second).1f scans/s, '
+                                '%(queries_per_scan)s queries/scan' % result)
+        transaction.rollback()
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump({
+                    'date': datetime.datetime.now().isoformat(),
+                    'database': config.get('database', 'uri'),
+                    'results': results,
+                    }, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
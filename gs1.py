@@ -0,0 +1,164 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+'''
+Parser of the GS1 element strings of GS1-128 and GS1 DataMatrix barcodes.
+
+Only the Application Identifiers used by the scanner are decoded, the others
+stop the parsing as their length is unknown.
+'''
+import datetime
+import re
+from decimal import Decimal
+
+GS = '\x1d'
+SYMBOLOGY_IDENTIFIERS = (']C1', ']e0', ']d2', ']Q3')
+# Application Identifier: (name, fixed length or None, maximum length)
+APPLICATION_IDENTIFIERS = {
+    '00': ('sscc', 18, 18),
+    '01': ('gtin', 14, 14),
+    '02': ('content', 14, 14),
+    '10': ('lot', None, 20),
+    '11': ('production_date', 6, 6),
+    '13': ('packaging_date', 6, 6),
+    '15': ('best_before_date', 6, 6),
+    '17': ('expiration_date', 6, 6),
+    '21': ('serial', None, 20),
+    '30': ('quantity', None, 8),
+    '37': ('count', None, 8),
+    }
+# Application Identifiers of 4 digits with the decimals as last digit
+DECIMAL_IDENTIFIERS = {
+    '310': 'net_weight',
+    }
+DATES = {'production_date', 'packaging_date', 'best_before_date',
+    'expiration_date'}
+INTEGERS = {'quantity', 'count'}
+_human_readable = re.compile(r'\((\d{2,4})\)([^(]*)')
+
+
+class GS1Error(ValueError):
+    pass
+
+
+def _century(year, today=None):
+    "Return the year of 2 digits with the century of the GS1 sliding window"
+    current = (today or datetime.date.today()).year
+    century = current - current % 100
+    difference = year - current % 100
+    # The years up to 50 years ahead or 49 years ago are chosen
+    if difference >= 51:
+        century -= 100
+    elif difference <= -50:
+        century += 100
+    return century + year
+
+
+def _date(value, today=None):
+    year, month, day = int(value[0:2]), int(value[2:4]), int(value[4:6])
+    if not 1 <= month <= 12:
+        raise GS1Error('Invalid month in date "%s"' % value)
+    year = _century(year, today)
+    if not day:
+        # A day of 00 means the last day of the month
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+        return datetime.date(year, month, 1) - datetime.timedelta(days=1)
+    return datetime.date(year, month, day)
+
+
+def _convert(name, value):
+    if name in DATES:
+        return _date(value)
+    elif name in INTEGERS:
+        return int(value)
+    return value
+
+
+def _lengths(ai):
+    "Return the fixed and the maximum length of the Application Identifier"
+    if ai in APPLICATION_IDENTIFIERS:
+        return APPLICATION_IDENTIFIERS[ai][1:]
+    elif len(ai) == 4 and ai[:3] in DECIMAL_IDENTIFIERS:
+        return 6, 6
+    raise GS1Error('Unknown Application Identifier "%s"' % ai)
+
+
+def _elements(code):
+    "Yield the Application Identifier and the value of each element"
+    if code.startswith('('):
+        position = 0
+        for match in _human_readable.finditer(code):
+            if match.start() != position:
+                break
+            ai, value = match.groups()
+            value = value.strip()
+            fixed, maximum = _lengths(ai)
+            if (fixed and len(value) != fixed) or len(value) > maximum:
+                raise GS1Error(
+                    'Invalid length for Application Identifier "%s"' % ai)
+            yield ai, value
+            position = match.end()
+        if position != len(code):
+            raise GS1Error('Invalid element string at "%s"' % code[position:])
+        return
+    position, length = 0, len(code)
+    while position < length:
+        if code[position] == GS:
+            position += 1
+            continue
+        ai = code[position:position + 2]
+        if ai in APPLICATION_IDENTIFIERS:
+            fixed, maximum = APPLICATION_IDENTIFIERS[ai][1:]
+            position += 2
+        elif code[position:position + 3] in DECIMAL_IDENTIFIERS:
+            ai = code[position:position + 4]
+            fixed = maximum = 6
+            position += 4
+        else:
+            raise GS1Error('Unknown Application Identifier at "%s"'
+                % code[position:])
+        if fixed:
+            end = position + fixed
+        else:
+            end = code.find(GS, position, position + maximum + 1)
+            if end < 0:
+                end = min(length, position + maximum)
+        value = code[position:end]
+        if fixed and len(value) != fixed:
+            raise GS1Error('Invalid length for Application Identifier "%s"'
+                % ai)
+        yield ai, value
+        position = end
+
+
+def parse(code):
+    '''
+    Return a dictionary with the values of the element string by name.
+
+    The decimal Application Identifiers are converted into Decimal numbers,
+    the dates into date and the quantities into integer. GS1Error is raised
+    for any invalid element string.
+    '''
+    for prefix in SYMBOLOGY_IDENTIFIERS:
+        if code.startswith(prefix):
+            code = code[len(prefix):]
+            break
+    result = {}
+    for ai, value in _elements(code):
+        try:
+            if ai in APPLICATION_IDENTIFIERS:
+                name = APPLICATION_IDENTIFIERS[ai][0]
+                result[name] = _convert(name, value)
+            elif ai[:3] in DECIMAL_IDENTIFIERS:
+                result[DECIMAL_IDENTIFIERS[ai[:3]]] = (
+                    Decimal(value).scaleb(-int(ai[3])))
+            else:
+                raise GS1Error('Unknown Application Identifier "%s"' % ai)
+        except GS1Error:
+            raise
+        except (ValueError, ArithmeticError) as exception:
+            raise GS1Error(
+                'Invalid value "%s" for Application Identifier "%s"'
+                % (value, ai)) from exception
+    return result
@@ -0,0 +1,127 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+'''
+Optional timing of the stages of the scans.
+
+It is enabled with the "instrumentation" key of the [stock_scanner_lot]
+section of the trytond configuration. Each measure is logged on the
+"trytond.modules.stock_scanner_lot.instrumentation" logger at debug level and
+aggregated by model and stage to compute their percentiles.
+'''
+import importlib
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from functools import wraps
+
+from trytond.config import config
+
+logger = logging.getLogger(__name__)
+# The cursor class of the database module of each backend
+CURSORS = {
+    'postgresql': 'LoggingCursor',
+    'sqlite': 'SQLiteCursor',
+    }
+_state = {}
+_counted = set()
+_local = threading.local()
+_lock = threading.Lock()
+_measures = defaultdict(lambda: deque(maxlen=config.getint(
+            'stock_scanner_lot', 'instrumentation_size', default=10000)))
+
+
+def enabled():
+    try:
+        return _state['enabled']
+    except KeyError:
+        _state['enabled'] = config.getboolean(
+            'stock_scanner_lot', 'instrumentation', default=False)
+        if _state['enabled']:
+            _count_queries()
+        return _state['enabled']
+
+
+def _counting(execute):
+    @wraps(execute)
+    def wrapper(self, *args, **kwargs):
+        _local.queries = getattr(_local, 'queries', 0) + 1
+        return execute(self, *args, **kwargs)
+    return wrapper
+
+
+def _count_queries():
+    "Count the queries executed by the cursors of the backend"
+    from trytond import backend
+    name = CURSORS.get(backend.name)
+    if not name:
+        logger.warning('Queries are not counted on the "%s" backend',
+            backend.name)
+        return
+    module = importlib.import_module(
+        'trytond.backend.%s.database' % backend.name)
+    cursor = getattr(module, name)
+    with _lock:
+        if cursor in _counted:
+            return
+        _counted.add(cursor)
+        for method in ['execute', 'executemany']:
+            setattr(cursor, method, _counting(getattr(cursor, method)))
+
+
+def instrumented(stage):
+    "Decorate a method of a model to measure it as the stage"
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self_or_cls, *args, **kwargs):
+            if not enabled():
+                return func(self_or_cls, *args, **kwargs)
+            queries = getattr(_local, 'queries', 0)
+            start = time.perf_counter()
+            try:
+                return func(self_or_cls, *args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                queries = getattr(_local, 'queries', 0) - queries
+                record(self_or_cls.__name__, stage, duration, queries)
+        return wrapper
+    return decorator
+
+
+def record(model, stage, duration, queries):
+    logger.debug('%s %s: %.3f ms, %d queries',
+        model, stage, duration * 1000, queries)
+    with _lock:
+        _measures[(model, stage)].append((duration, queries))
+
+
+def _percentile(values, percent):
+    index = min(len(values) - 1, int(round(percent / 100 * len(values))))
+    return values[index]
+
+
+def statistics():
+    "Return the count and percentiles of the measures by model and stage"
+    with _lock:
+        measures = {k: list(v) for k, v in _measures.items()}
+    result = []
+    for (model, stage), values in sorted(measures.items()):
+        durations = sorted(d for d, _ in values)
+        queries = sorted(q for _, q in values)
+        result.append({
+                'model': model,
+                'stage': stage,
+                'count': len(values),
+                'p50': _percentile(durations, 50),
+                'p95': _percentile(durations, 95),
+                'p99': _percentile(durations, 99),
+                'queries_p50': _percentile(queries, 50),
+                'queries_p95': _percentile(queries, 95),
+                'queries_p99': _percentile(queries, 99),
+                })
+    return result
+
+
+def reset():
+    with _lock:
+        _measures.clear()
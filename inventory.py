@@ -0,0 +1,185 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from trytond.model import ModelView, fields
+from trytond.pool import Pool, PoolMeta
+from trytond.pyson import Bool, Eval, If
+from trytond.rpc import RPC
+
+from .instrumentation import instrumented
+
+_STATES = {
+    'readonly': Eval('state') != 'draft',
+    }
+
+
+class InventoryLineIndex(object):
+    '''
+    Lines of an inventory indexed by product and lot so the scans are matched
+    with a dictionary lookup instead of a search per line.
+    '''
+
+    def __init__(self, lines):
+        self._lines = {}
+        self.to_save = []
+        self._to_save_ids = set()
+        for line in lines:
+            self._lines.setdefault((line.product, line.lot), line)
+
+    def get(self, product, lot):
+        "Return the line of the product and the lot, created if missing"
+        pool = Pool()
+        Line = pool.get('stock.inventory.line')
+        line = self._lines.get((product, lot))
+        if line is None:
+            line = self._lines[(product, lot)] = Line(
+                product=product, lot=lot, quantity=0)
+        return line
+
+    def add(self, product, lot, quantity):
+        "Add the quantity to the line of the product and the lot"
+        line = self.get(product, lot)
+        line.quantity = (line.quantity or 0) + quantity
+        if id(line) not in self._to_save_ids:
+            self._to_save_ids.add(id(line))
+            self.to_save.append(line)
+        return line
+
+
+class Inventory(metaclass=PoolMeta):
+    __name__ = 'stock.inventory'
+
+    scanned_product = fields.Many2One('product.product', 'Scanned Product',
+        domain=[
+            ('type', '=', 'goods'),
+            ],
+        states=_STATES)
+    scanned_lot_number = fields.Char('Scanned Lot Number', states={
+            'readonly': (Bool(Eval('scanned_lot', False))
+                | (Eval('state') != 'draft')),
+            },
+        help="Lot number of the lot that will be scanned.")
+    scanned_lot = fields.Many2One('stock.lot', 'Scanned Lot', domain=[
+            If(Bool(Eval('scanned_product')),
+                ('product', '=', Eval('scanned_product')),
+                ()),
+            ],
+        states=_STATES)
+    scanned_quantity = fields.Float('Scanned Quantity', states=_STATES)
+
+    @classmethod
+    def __setup__(cls):
+        super(Inventory, cls).__setup__()
+        cls._buttons.update({
+                'scan': {
+                    'invisible': Eval('state') != 'draft',
+                    'depends': ['state'],
+                    },
+                })
+        cls.__rpc__.update({
+                'scan_batch': RPC(readonly=False, instantiate=0),
+                })
+
+    @staticmethod
+    def default_scanned_quantity():
+        return 1.
+
+    @fields.depends('scanned_lot', 'scanned_product')
+    def on_change_scanned_lot(self):
+        if self.scanned_lot:
+            self.scanned_lot_number = self.scanned_lot.number
+            self.scanned_product = self.scanned_lot.product
+
+    @fields.depends('scanned_lot_number', 'scanned_product')
+    def on_change_scanned_lot_number(self):
+        pool = Pool()
+        Config = pool.get('stock.configuration')
+        Lot = pool.get('stock.lot')
+        settings = Config.get_scanner_settings(self.scanned_product)
+        self.scanned_lot = Lot.find_scanner_lot(self.scanned_product,
+            self.scanned_lot_number, settings['lot_matching'])
+
+    def get_scan(self):
+        "Return the scanned values in the format of scan_batch"
+        scan = {
+            'product': self.scanned_product.id,
+            'quantity': self.scanned_quantity,
+            }
+        if self.scanned_lot:
+            scan['lot'] = self.scanned_lot.id
+        elif self.scanned_lot_number:
+            scan['lot_number'] = self.scanned_lot_number
+        return scan
+
+    def clear_scan_values(self):
+        self.scanned_product = None
+        self.scanned_lot_number = None
+        self.scanned_lot = None
+        self.scanned_quantity = self.default_scanned_quantity()
+
+    @classmethod
+    @ModelView.button
+    def scan(cls, inventories):
+        for inventory in inventories:
+            if inventory.scanned_product and inventory.scanned_quantity:
+                cls.scan_batch([inventory], [inventory.get_scan()])
+            inventory.clear_scan_values()
+        cls.save(inventories)
+
+    @classmethod
+    def _get_scanner_lot(cls, product, number):
+        '''
+        Return the lot of the product matching the number, a new lot if it is
+        missing and a lot creation is set or None.
+
+        The counted lots must be the existing ones so the "Always" lot
+        creation also reuses the matching lot.
+        '''
+        pool = Pool()
+        Config = pool.get('stock.configuration')
+        Lot = pool.get('stock.lot')
+        settings = Config.get_scanner_settings(product)
+        lot = Lot.find_scanner_lot(product, number, settings['lot_matching'])
+        if lot is None and settings['lot_creation']:
+            lot = Lot(product=product, number=number)
+        return lot
+
+    @classmethod
+    @instrumented('inventory_scan_batch')
+    def scan_batch(cls, inventories, scans):
+        '''
+        Add the scanned quantities to the lines of the inventories with the
+        same product and lot or to new lines.
+
+        Each scan is a dictionary with the keys 'product', 'quantity' and
+        optionally 'lot' or 'lot_number'. The lot numbers are matched with
+        the lot matching of the stock configuration and the missing lots are
+        created if a lot creation is set, otherwise the lines have no lot.
+        '''
+        pool = Pool()
+        Lot = pool.get('stock.lot')
+        Line = pool.get('stock.inventory.line')
+        Product = pool.get('product.product')
+
+        lots = Lot.search_scanner_lots(scans)
+        to_save_lots, to_save_lines = [], []
+        for inventory in inventories:
+            index = InventoryLineIndex(inventory.lines)
+            for scan in scans:
+                product = Product(scan['product'])
+                lot = None
+                if scan.get('lot'):
+                    lot = Lot(scan['lot'])
+                elif scan.get('lot_number'):
+                    key = (product.id, scan['lot_number'])
+                    if key not in lots:
+                        lot = lots[key] = cls._get_scanner_lot(
+                            product, scan['lot_number'])
+                        if lot and lot.id is None:
+                            to_save_lots.append(lot)
+                    lot = lots[key]
+                index.add(product, lot, scan['quantity'])
+            for line in index.to_save:
+                line.inventory = inventory
+            to_save_lines.extend(index.to_save)
+        Lot.save(to_save_lots)
+        Line.save(to_save_lines)
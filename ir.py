@@ -0,0 +1,20 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from trytond.pool import PoolMeta
+
+
+class Cron(metaclass=PoolMeta):
+    __name__ = 'ir.cron'
+
+    @classmethod
+    def __setup__(cls):
+        super(Cron, cls).__setup__()
+        cls.method.selection.append(
+            ('stock.scanner.lot.journal|process_journal',
+                'Process Scanner Lot Journal'))
+        cls.method.selection.append(
+            ('stock.lot|deduplicate_scanner_lots',
+                'Merge Duplicated Lots'))
+        cls.method.selection.append(
+            ('stock.lot|refresh_scanner_snapshot',
+                'Refresh Scanner Lot Snapshot'))
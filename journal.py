@@ -0,0 +1,228 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import datetime
+import logging
+from collections import OrderedDict
+
+from sql.aggregate import Min
+
+from trytond import backend
+from trytond.config import config
+from trytond.model import Index, ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.pyson import Eval
+from trytond.transaction import Transaction, TransactionError
+
+logger = logging.getLogger(__name__)
+
+
+class ScannerLotJournal(ModelSQL, ModelView):
+    'Stock Scanner Lot Journal'
+    __name__ = 'stock.scanner.lot.journal'
+
+    shipment = fields.Reference('Shipment', selection='get_shipments',
+        required=True, readonly=True)
+    product = fields.Many2One('product.product', 'Product', required=True,
+        readonly=True)
+    lot_number = fields.Char('Lot Number', readonly=True)
+    lot = fields.Many2One('stock.lot', 'Lot', readonly=True, domain=[
+            ('product', '=', Eval('product', -1)),
+            ])
+    quantity = fields.Float('Quantity', required=True, readonly=True)
+    expiration_date = fields.Date('Expiration Date', readonly=True,
+        help='The expiration date of the lot created by the scan.')
+    device = fields.Char('Device', readonly=True,
+        help='The device which scanned the product.')
+    timestamp = fields.Timestamp('Timestamp', required=True, readonly=True)
+    sequence = fields.Integer('Sequence', readonly=True,
+        help='The order of the scans of the device with the same timestamp.')
+    state = fields.Selection([
+            ('pending', 'Pending'),
+            ('done', 'Done'),
+            ('error', 'Error'),
+            ], 'State', required=True, readonly=True)
+    error_message = fields.Text('Error Message', readonly=True, states={
+            'invisible': Eval('state') != 'error',
+            },
+        help='The error raised when the entry was replayed.')
+
+    @classmethod
+    def __setup__(cls):
+        super(ScannerLotJournal, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(
+                    t, (t.state, Index.Equality(cardinality='low')),
+                    where=t.state == 'pending'),
+                })
+        cls._order = [
+            ('timestamp', 'ASC'),
+            ('sequence', 'ASC NULLS FIRST'),
+            ('id', 'ASC'),
+            ]
+        cls._buttons.update({
+                'retry': {
+                    'invisible': Eval('state') != 'error',
+                    'depends': ['state'],
+                    },
+                })
+
+    @staticmethod
+    def default_timestamp():
+        return datetime.datetime.now()
+
+    @staticmethod
+    def default_state():
+        return 'pending'
+
+    @classmethod
+    def _get_shipment_models(cls):
+        return [
+            'stock.shipment.in',
+            'stock.shipment.in.return',
+            'stock.shipment.out',
+            'stock.shipment.out.return',
+            'stock.shipment.internal',
+            'stock.inventory',
+            ]
+
+    @classmethod
+    def get_shipments(cls):
+        pool = Pool()
+        Model = pool.get('ir.model')
+        return [(None, '')] + [(m, Model.get_name(m))
+            for m in cls._get_shipment_models()]
+
+    def get_scan(self):
+        "Return the scan of the entry in the format of scan_batch"
+        scan = {
+            'product': self.product.id,
+            'quantity': self.quantity,
+            }
+        if self.lot:
+            scan['lot'] = self.lot.id
+        elif self.lot_number:
+            scan['lot_number'] = self.lot_number
+        if self.expiration_date:
+            scan['expiration_date'] = self.expiration_date
+        return scan
+
+    @classmethod
+    def replay(cls, entries):
+        '''
+        Process the entries in order on their shipments.
+
+        The shipments are locked so the entries of a shipment are never
+        processed by two transactions at the same time.
+        '''
+        pool = Pool()
+        shipments = OrderedDict()
+        for entry in entries:
+            shipments.setdefault(entry.shipment, []).append(entry.id)
+        for shipment, entry_ids in shipments.items():
+            Shipment = pool.get(shipment.__name__)
+            Shipment.lock([shipment])
+            pending = cls.search([
+                    ('id', 'in', entry_ids),
+                    ('state', '=', 'pending'),
+                    ])
+            if not pending:
+                continue
+            Shipment.scan_batch([shipment], [e.get_scan() for e in pending])
+            cls.write(pending, {'state': 'done'})
+
+    @classmethod
+    @ModelView.button
+    def retry(cls, entries):
+        "Set the entries in error back to pending to replay them again"
+        cls.write(entries, {
+                'state': 'pending',
+                'error_message': None,
+                })
+
+    @classmethod
+    def _replay_or_fail(cls, entries):
+        '''
+        Replay the entries or roll back the transaction and set them in error
+        with the message of the exception.
+
+        The errors of the transaction and of the database are raised to retry
+        the transaction.
+        '''
+        transaction = Transaction()
+        try:
+            cls.replay(entries)
+        except (TransactionError, backend.DatabaseOperationalError):
+            raise
+        except Exception as exception:
+            transaction.rollback()
+            message = getattr(exception, 'message', None) or str(exception)
+            logger.warning("Scanner lot journal entries %s failed: %s",
+                [e.id for e in entries], message, exc_info=True)
+            cls.write(cls.browse(entries), {
+                    'state': 'error',
+                    'error_message': message,
+                    })
+
+    @classmethod
+    def process_shipments(cls, entries):
+        "Replay all the pending entries of the shipments of the entries"
+        shipments = list({str(e.shipment) for e in entries})
+        cls._replay_or_fail(cls.search([
+                    ('shipment', 'in', shipments),
+                    ('state', '=', 'pending'),
+                    ]))
+
+    @classmethod
+    def process_journal(cls):
+        '''
+        Replay the pending entries of each shipment by chunks, each chunk in
+        its own transaction.
+
+        The shipments with entries in error are skipped to keep the order of
+        their scans until the errors are retried. The size of the chunks is
+        set with the "journal_chunk" key of the [stock_scanner_lot] section of
+        the trytond configuration.
+        '''
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+        cursor.execute(*table.select(table.shipment,
+                where=table.state == 'pending',
+                group_by=[table.shipment],
+                order_by=[Min(table.id).asc]))
+        for shipment, in cursor.fetchall():
+            try:
+                while cls._process_shipment_chunk(shipment):
+                    pass
+            except backend.DatabaseOperationalError:
+                logger.warning("Scanner lot journal of %s not replayed",
+                    shipment, exc_info=True)
+
+    @classmethod
+    def _process_shipment_chunk(cls, shipment):
+        '''
+        Replay a chunk of the pending entries of the shipment in a new
+        transaction and return True if there may be more to replay.
+        '''
+        size = config.getint('stock_scanner_lot', 'journal_chunk',
+            default=100)
+        extras = {}
+        while True:
+            try:
+                with Transaction().new_transaction(**extras):
+                    if cls.search([
+                                ('shipment', '=', shipment),
+                                ('state', '=', 'error'),
+                                ], limit=1):
+                        return False
+                    entries = cls.search([
+                            ('shipment', '=', shipment),
+                            ('state', '=', 'pending'),
+                            ], limit=size)
+                    if not entries:
+                        return False
+                    cls._replay_or_fail(entries)
+                    return len(entries) == size
+            except TransactionError as e:
+                e.fix(extras)
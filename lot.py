@@ -0,0 +1,414 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import logging
+import threading
+from collections import deque
+from weakref import WeakKeyDictionary
+
+from sql import Column, Literal, Null
+from sql.aggregate import Count, Min
+from sql.conditionals import Coalesce
+from sql.functions import CharLength, CurrentTimestamp, Function, Lower, Trim
+from sql.operators import Like
+
+from trytond.cache import Cache
+from trytond.config import config
+from trytond.model import Index, ModelSQL, fields
+from trytond.pool import Pool, PoolMeta
+from trytond.rpc import RPC
+from trytond.tools import escape_wildcard, grouped_slice, reduce_ids
+from trytond.transaction import Transaction
+
+from . import snapshot
+
+logger = logging.getLogger(__name__)
+# The lots created or modified by each transaction which must not be stored
+# in the cache or the snapshot before they are committed
+_modified_lots = WeakKeyDictionary()
+
+LOT_MATCHING_STRATEGIES = [
+    ('exact', 'Exact'),
+    ('normalized', 'Normalized'),
+    ('prefix', 'Prefix'),
+    ('similarity', 'Similarity'),
+    ]
+
+
+class Replace(Function):
+    __slots__ = ()
+    _function = 'REPLACE'
+
+
+def normalize_lot_number(number):
+    "Return the number without spaces, in lower case and without leading 0"
+    return number.replace(' ', '').lower().lstrip('0')
+
+
+class LotNumberAllocator(object):
+    '''
+    Hand out the lot numbers of a sequence from blocks reserved in their own
+    transaction, so the scanner does not lock the sequence on each lot and
+    the numbers are never given twice even if the scan is rolled back.
+
+    The size of the blocks is set with the "lot_number_block" key of the
+    [stock_scanner_lot] section of the trytond configuration.
+    '''
+    _blocks = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, sequence_id):
+        "Return the next lot number of the sequence"
+        key = (Transaction().database.name, sequence_id)
+        with cls._lock:
+            numbers = cls._blocks.get(key)
+            if not numbers:
+                numbers = cls._blocks[key] = deque(cls._reserve(sequence_id))
+            return numbers.popleft()
+
+    @classmethod
+    def _reserve(cls, sequence_id):
+        size = config.getint(
+            'stock_scanner_lot', 'lot_number_block', default=20)
+        with Transaction().new_transaction() as transaction:
+            pool = Pool()
+            Sequence = pool.get('ir.sequence')
+            numbers = list(Sequence(sequence_id).get_many(n=size))
+            transaction.commit()
+        return numbers
+
+
+class Lot(metaclass=PoolMeta):
+    __name__ = 'stock.lot'
+    # The size is configured with the "stock.lot.scanner_number" key of the
+    # [cache] section of the trytond configuration
+    _scanner_number_cache = Cache('stock.lot.scanner_number', context=False)
+    scanner_always = fields.Boolean('Created Always', readonly=True,
+        help='Created by the scanner with the "Always" lot creation, so it '
+        'may share its number with other lots and it is never merged.')
+
+    @classmethod
+    def __setup__(cls):
+        super(Lot, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(
+                    t,
+                    (t.product, Index.Equality()),
+                    (t.number, Index.Equality())),
+                Index(t, (t.number, Index.Similarity(begin=True))),
+                Index(
+                    t,
+                    (t.product, Index.Equality()),
+                    (cls._scanner_normalized_number(t.number),
+                        Index.Equality())),
+                })
+        # The expiration date is defined by stock_lot_sle
+        if hasattr(cls, 'expiration_date'):
+            cls._sql_indexes.add(
+                Index(
+                    t,
+                    (t.product, Index.Equality()),
+                    (t.expiration_date, Index.Range())))
+        cls.__rpc__.update({
+                'scanner_cache_stats': RPC(),
+                'match_scanner_lots': RPC(result=lambda r: [l.id for l in r]),
+                })
+
+    @classmethod
+    def get_scanner_lot(cls, product, number):
+        "Return the lot of the product with the number or None"
+        if not product or not number:
+            return
+        key = (int(product), number)
+        lot_id = cls._scanner_number_cache.get(key)
+        if lot_id is None and snapshot.path():
+            lot_id = snapshot.lookup(*key)
+            if lot_id is not None:
+                cls._scanner_number_cache.set(key, lot_id)
+        if lot_id is None:
+            lots = cls.search([
+                    ('number', '=', number),
+                    ('product', '=', int(product)),
+                    ], limit=1)
+            if not lots:
+                # The misses are not cached so the creation of the lots does
+                # not need to clear the cache
+                return
+            lot_id = lots[0].id
+            if lot_id not in _modified_lots.get(Transaction(), ()):
+                cls._scanner_number_cache.set(key, lot_id)
+                if snapshot.path():
+                    snapshot.store(*key, lot_id)
+        return cls(lot_id)
+
+    @staticmethod
+    def _scanner_normalized_number(column):
+        "Return the SQL expression of normalize_lot_number"
+        return Trim(Lower(Replace(column, ' ', '')), 'LEADING', '0')
+
+    @classmethod
+    def match_scanner_lots(cls, product, number, strategy='exact', limit=10):
+        '''
+        Return the active lots of the product matching the scanned number
+        from the best match.
+
+        The strategies are tried in order up to the given one and the first
+        one which finds lots wins: the exact number, the normalized number
+        (see normalize_lot_number), the numbers starting with the scanned one
+        and, on databases supporting it, the numbers with a trigram similarity
+        above the "similarity_threshold" key of the [stock_scanner_lot]
+        section of the trytond configuration.
+        '''
+        if not product or not number:
+            return []
+        lot = cls.get_scanner_lot(product, number)
+        if lot:
+            return [lot]
+        strategies = [s for s, _ in LOT_MATCHING_STRATEGIES]
+        level = strategies.index(strategy)
+        transaction = Transaction()
+        database = transaction.database
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+        where = ((table.product == int(product))
+            & (table.active == Literal(True)))
+
+        queries = []
+        if level >= strategies.index('normalized'):
+            queries.append(table.select(table.id,
+                    where=where & (cls._scanner_normalized_number(table.number)
+                        == normalize_lot_number(number)),
+                    order_by=[table.id.asc],
+                    limit=limit))
+        if level >= strategies.index('prefix'):
+            queries.append(table.select(table.id,
+                    where=where & Like(
+                        table.number, escape_wildcard(number) + '%',
+                        escape='\\'),
+                    order_by=[CharLength(table.number).asc, table.id.asc],
+                    limit=limit))
+        if (level >= strategies.index('similarity')
+                and database.has_similarity()):
+            threshold = config.getfloat(
+                'stock_scanner_lot', 'similarity_threshold', default=0.3)
+            similarity = database.similarity(table.number, number)
+            queries.append(table.select(table.id,
+                    where=where & (similarity >= threshold),
+                    order_by=[similarity.desc, table.id.asc],
+                    limit=limit))
+        for query in queries:
+            cursor.execute(*query)
+            ids = [i for i, in cursor]
+            if ids:
+                return cls.browse(ids)
+        return []
+
+    @classmethod
+    def find_scanner_lot(cls, product, number, strategy='exact'):
+        '''
+        Return the only lot of the product matching the scanned number with
+        the strategy or None.
+
+        The prefix and similarity matches may be other lots than the scanned
+        one so they are only candidates for the user and the normalized
+        number is used instead.
+        '''
+        if strategy not in {'exact', 'normalized'}:
+            strategy = 'normalized'
+        lots = cls.match_scanner_lots(product, number, strategy, limit=2)
+        if len(lots) == 1:
+            return lots[0]
+
+    @classmethod
+    def prefetch_scanner_lots(cls, lots):
+        "Fill the lot number cache with the lots"
+        cache = cls._scanner_number_cache
+        modified = _modified_lots.get(Transaction(), ())
+        keys = set()
+        for lot in sorted(lots, key=lambda l: l.id):
+            key = (lot.product.id, lot.number)
+            if key not in keys:
+                keys.add(key)
+                if lot.id not in modified:
+                    cache.set(key, lot.id)
+
+    @classmethod
+    def search_scanner_lots(cls, scans):
+        '''
+        Return a dictionary with the lot of each (product id, lot number) of
+        the scans without lot with a single search.
+        '''
+        product_ids = set()
+        numbers = set()
+        for scan in scans:
+            if not scan.get('lot') and scan.get('lot_number'):
+                product_ids.add(scan['product'])
+                numbers.add(scan['lot_number'])
+        lots = {}
+        if numbers:
+            for lot in cls.search([
+                        ('number', 'in', list(numbers)),
+                        ('product', 'in', list(product_ids)),
+                        ]):
+                lots.setdefault((lot.product.id, lot.number), lot)
+        return lots
+
+    @classmethod
+    def _scanner_lot_references(cls):
+        "Yield the model and the name of the stored fields linking to lots"
+        pool = Pool()
+        for _, Model in pool.iterobject():
+            if (not issubclass(Model, ModelSQL)
+                    or Model._is_table_query()):
+                continue
+            for name, field in Model._fields.items():
+                if (field._type == 'many2one'
+                        and field.model_name == cls.__name__
+                        and not isinstance(field, fields.Function)):
+                    yield Model, name
+
+    @classmethod
+    def _scanner_duplicate_keys(cls, table):
+        "Return the columns which must be equal for lots to be duplicated"
+        keys = [table.product, table.number]
+        # The expiration date is defined by stock_lot_sle
+        if hasattr(cls, 'expiration_date'):
+            keys.append(table.expiration_date)
+        return keys
+
+    @classmethod
+    def deduplicate_scanner_lots(cls, dry_run=False):
+        '''
+        Merge the active lots with the same product, number and expiration
+        date into the oldest one.
+
+        The lots created with the "Always" lot creation are never merged and
+        the lots of done or cancelled moves are kept as they are.
+        The records linked to the duplicated lots are updated to the oldest
+        lot and the duplicated lots are archived by chunks committing after
+        each one. The size of the chunks is set with the "deduplicate_chunk"
+        key of the [stock_scanner_lot] section of the trytond configuration.
+
+        Return the list of product id, number, id of the kept lot and number
+        of lots of the duplicated numbers. Nothing is changed with dry_run.
+        '''
+        pool = Pool()
+        Move = pool.get('stock.move')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        size = config.getint('stock_scanner_lot', 'deduplicate_chunk',
+            default=1000)
+        lot = cls.__table__()
+        other = cls.__table__()
+        move = Move.__table__()
+
+        def mergeable(table):
+            return ((table.active == Literal(True))
+                & (Coalesce(table.scanner_always, Literal(False))
+                    == Literal(False)))
+
+        def same(table, other):
+            condition = Literal(True)
+            for column, other_column in zip(
+                    cls._scanner_duplicate_keys(table),
+                    cls._scanner_duplicate_keys(other)):
+                condition &= ((column == other_column)
+                    | ((column == Null) & (other_column == Null)))
+            return condition
+
+        keys = cls._scanner_duplicate_keys(lot)
+        cursor.execute(*lot.select(
+                lot.product, lot.number, Min(lot.id), Count(Literal('*')),
+                where=mergeable(lot),
+                group_by=keys,
+                having=Count(Literal('*')) > 1,
+                order_by=[Min(lot.id).asc]))
+        report = list(cursor)
+        logger.info("%s duplicated lot numbers found", len(report))
+        if dry_run or not report:
+            return report
+
+        # The stock of the closed moves must not change
+        closed = move.select(move.lot,
+            where=move.state.in_(['done', 'cancelled'])
+            & (move.lot != Null))
+        cursor.execute(*lot.join(other,
+                condition=same(lot, other)
+                & (other.id < lot.id)
+                & mergeable(other)
+                ).select(lot.id,
+                where=mergeable(lot) & ~lot.id.in_(closed),
+                group_by=[lot.id],
+                order_by=[lot.id.asc]))
+        duplicate_ids = [i for i, in cursor]
+        references = list(cls._scanner_lot_references())
+
+        done = 0
+        for sub_ids in grouped_slice(duplicate_ids, size):
+            sub_ids = list(sub_ids)
+            for Model, name in references:
+                table = Model.__table__()
+                column = Column(table, name)
+                duplicate = cls.__table__()
+                kept = cls.__table__()
+                kept_id = duplicate.join(kept,
+                    condition=same(kept, duplicate)
+                    ).select(Min(kept.id),
+                    where=(duplicate.id == column) & mergeable(kept))
+                cursor.execute(*table.update(
+                        [column, table.write_uid, table.write_date],
+                        [kept_id, transaction.user, CurrentTimestamp()],
+                        where=reduce_ids(column, sub_ids)))
+            cursor.execute(*lot.update(
+                    [lot.active, lot.write_uid, lot.write_date],
+                    [Literal(False), transaction.user, CurrentTimestamp()],
+                    where=reduce_ids(lot.id, sub_ids)))
+            transaction.commit()
+            if snapshot.path():
+                snapshot.discard(sub_ids)
+            done += len(sub_ids)
+            logger.info("%s/%s duplicated lots merged",
+                done, len(duplicate_ids))
+        cls._scanner_number_cache.clear()
+        return report
+
+    @classmethod
+    def refresh_scanner_snapshot(cls):
+        "Store in the snapshot the lots committed since its last refresh"
+        if snapshot.path():
+            count = snapshot.refresh()
+            logger.info("%s lots refreshed in the snapshot", count)
+
+    @classmethod
+    def scanner_cache_stats(cls):
+        "Return the hits, misses and size of the lot number cache"
+        cache = cls._scanner_number_cache
+        return {
+            'hit': cache.hit,
+            'miss': cache.miss,
+            'size': cache.size_limit,
+            }
+
+    @classmethod
+    def create(cls, vlist):
+        lots = super(Lot, cls).create(vlist)
+        _modified_lots.setdefault(Transaction(), set()).update(
+            l.id for l in lots)
+        return lots
+
+    @classmethod
+    def write(cls, *args):
+        super(Lot, cls).write(*args)
+        cls._scanner_number_cache.clear()
+        lot_ids = [l.id for l in sum(args[0:None:2], [])]
+        _modified_lots.setdefault(Transaction(), set()).update(lot_ids)
+        if snapshot.path():
+            snapshot.discard(lot_ids)
+
+    @classmethod
+    def delete(cls, lots):
+        if snapshot.path():
+            snapshot.discard([l.id for l in lots])
+        super(Lot, cls).delete(lots)
+        cls._scanner_number_cache.clear()
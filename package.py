@@ -0,0 +1,73 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from trytond.model import Index, ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.pyson import Eval
+
+
+class ScannerLotPackage(ModelSQL, ModelView):
+    'Stock Scanner Lot Package'
+    __name__ = 'stock.scanner.lot.package'
+    _rec_name = 'code'
+
+    code = fields.Char('Code', required=True,
+        help='The SSCC or the code of the package or the pallet.')
+    lines = fields.One2Many('stock.scanner.lot.package.line', 'package',
+        'Lines', help='The content of the package.')
+    shipment = fields.Reference('Shipment', selection='get_shipments',
+        readonly=True, help='The shipment where the package was scanned.')
+
+    @classmethod
+    def __setup__(cls):
+        super(ScannerLotPackage, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t, (t.code, Index.Equality())),
+                })
+
+    @classmethod
+    def get_shipments(cls):
+        pool = Pool()
+        Journal = pool.get('stock.scanner.lot.journal')
+        return Journal.get_shipments()
+
+    @classmethod
+    def get_scanner_package(cls, code):
+        "Return the last package with the code not yet scanned or None"
+        packages = cls.search([
+                ('code', '=', code),
+                ('shipment', '=', None),
+                ], order=[('id', 'DESC')], limit=1)
+        if packages:
+            package, = packages
+            return package
+
+    def get_scans(self):
+        "Return the content of the package in the format of scan_batch"
+        return [l.get_scan() for l in self.lines]
+
+
+class ScannerLotPackageLine(ModelSQL, ModelView):
+    'Stock Scanner Lot Package Line'
+    __name__ = 'stock.scanner.lot.package.line'
+
+    package = fields.Many2One('stock.scanner.lot.package', 'Package',
+        required=True, ondelete='CASCADE')
+    product = fields.Many2One('product.product', 'Product', required=True)
+    lot_number = fields.Char('Lot Number')
+    lot = fields.Many2One('stock.lot', 'Lot', domain=[
+            ('product', '=', Eval('product', -1)),
+            ])
+    quantity = fields.Float('Quantity', required=True)
+
+    def get_scan(self):
+        "Return the line in the format of scan_batch"
+        scan = {
+            'product': self.product.id,
+            'quantity': self.quantity,
+            }
+        if self.lot:
+            scan['lot'] = self.lot.id
+        elif self.lot_number:
+            scan['lot_number'] = self.lot_number
+        return scan
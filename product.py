@@ -0,0 +1,26 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from trytond.pool import Pool, PoolMeta
+
+
+class Template(metaclass=PoolMeta):
+    __name__ = 'product.template'
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        Configuration = pool.get('stock.configuration')
+        actions = iter(args)
+        # The scanner settings only store the lot required of the templates
+        clear = any('lot_required' in values
+            for _, values in zip(actions, actions))
+        super(Template, cls).write(*args)
+        if clear:
+            Configuration._scanner_settings_cache.clear()
+
+    @classmethod
+    def delete(cls, templates):
+        pool = Pool()
+        Configuration = pool.get('stock.configuration')
+        super(Template, cls).delete(templates)
+        Configuration._scanner_settings_cache.clear()
@@ -51,6 +51,10 @@ requires.append(get_require_version('trytond'))
 tests_require = [
     get_require_version('proteus'),
 ]
+for dep in info.get('extras_depend', []):
+    if not re.match(r'(ir|res)(\W|$)', dep):
+        prefix = MODULE2PREFIX.get(dep, 'trytond')
+        tests_require.append(get_require_version('%s_%s' % (prefix, dep)))
 
 series = '%s.%s' % (major_version, minor_version)
 if minor_version % 2:
@@ -0,0 +1,180 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+'''
+Optional snapshot of the lot ids by product and number shared by the trytond
+processes of a host.
+
+It is enabled by setting the path of the snapshot file with the "snapshot" key
+of the [stock_scanner_lot] section of the trytond configuration. The snapshot
+is a SQLite file filled out of band by the "Refresh Scanner Lot Snapshot"
+scheduled action with the lots created or modified since its watermark, and
+by the lookups with the committed lots they found in the database. The lots
+modified during the "snapshot_margin" seconds before the watermark are read
+again to catch the transactions which committed late. An entry is not used
+when neither it nor the last refresh is younger than "snapshot_max_age"
+seconds, so the lookup falls back to the database and stores the lot again.
+
+The file is local to a host: the lots modified on another host are only
+removed by the next refresh of the snapshot or when their entry expires.
+The SQLite errors are logged and the lookups fall back to the database.
+'''
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+
+from sql.conditionals import Coalesce
+
+from trytond.config import config
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+logger = logging.getLogger(__name__)
+_local = threading.local()
+
+
+def path():
+    return config.get('stock_scanner_lot', 'snapshot', default=None)
+
+
+def _connection():
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    filename = path()
+    connection = connections.get(filename)
+    if connection is None:
+        connection = connections[filename] = sqlite3.connect(
+            filename, timeout=10, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS lot ('
+            'database TEXT, product INTEGER, number TEXT, lot INTEGER, '
+            'stored REAL, PRIMARY KEY (database, product, number))')
+        connection.execute('CREATE INDEX IF NOT EXISTS lot_id '
+            'ON lot (database, lot)')
+        connection.execute('CREATE TABLE IF NOT EXISTS watermark ('
+            'database TEXT PRIMARY KEY, timestamp TEXT, refreshed REAL)')
+    return connection
+
+
+def _failed(action):
+    "Log the failure of the action and open the snapshot again next time"
+    logger.warning("Scanner lot snapshot %s failed", action, exc_info=True)
+    connections = getattr(_local, 'connections', None)
+    if connections:
+        connections.pop(path(), None)
+
+
+def _max_age():
+    return config.getint('stock_scanner_lot', 'snapshot_max_age', default=600)
+
+
+def lookup(product_id, number):
+    '''
+    Return the id of the lot of the product with the number from the snapshot
+    or None if it is not known or too old.
+    '''
+    database = Transaction().database.name
+    try:
+        row = _connection().execute(
+            'SELECT lot.lot FROM lot '
+            'LEFT JOIN watermark ON watermark.database = lot.database '
+            'WHERE lot.database = ? AND lot.product = ? AND lot.number = ? '
+            'AND MAX(COALESCE(lot.stored, 0), '
+            'COALESCE(watermark.refreshed, 0)) >= ?',
+            (database, product_id, number, time.time() - _max_age())
+            ).fetchone()
+    except sqlite3.Error:
+        _failed('lookup')
+        return
+    if row is not None:
+        return row[0]
+
+
+def store(product_id, number, lot_id):
+    "Store the committed lot of the product with the number"
+    database = Transaction().database.name
+    try:
+        _connection().execute(
+            'INSERT OR REPLACE INTO lot VALUES (?, ?, ?, ?, ?)',
+            (database, product_id, number, lot_id, time.time()))
+    except sqlite3.Error:
+        _failed('store')
+
+
+def refresh():
+    '''
+    Store in the snapshot the lots committed since its watermark and return
+    the number of lots read.
+    '''
+    database = Transaction().database.name
+    started = time.time()
+    connection = _connection()
+    row = connection.execute(
+        'SELECT timestamp FROM watermark WHERE database = ?',
+        (database,)).fetchone()
+    watermark = None
+    if row and row[0]:
+        margin = config.getint(
+            'stock_scanner_lot', 'snapshot_margin', default=300)
+        watermark = (datetime.datetime.fromisoformat(row[0])
+            - datetime.timedelta(seconds=margin))
+
+    count = 0
+    with Transaction().new_transaction(readonly=True) as transaction:
+        pool = Pool()
+        Lot = pool.get('stock.lot')
+        lot = Lot.__table__()
+        cursor = transaction.connection.cursor()
+        timestamp = Coalesce(lot.write_date, lot.create_date)
+        where = None
+        if watermark:
+            where = timestamp >= watermark
+        cursor.execute(*lot.select(
+                lot.id, lot.product, lot.number, lot.active, timestamp,
+                where=where, order_by=[timestamp.asc]))
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany(
+                    'DELETE FROM lot WHERE database = ? AND lot = ?',
+                    [(database, r[0]) for r in rows])
+                connection.executemany(
+                    'INSERT OR IGNORE INTO lot VALUES (?, ?, ?, ?, ?)',
+                    [(database, r[1], r[2], r[0], started)
+                        for r in rows if r[3]])
+                watermark = rows[-1][4]
+                if isinstance(watermark, datetime.datetime):
+                    watermark = watermark.isoformat()
+                connection.execute(
+                    'INSERT INTO watermark (database, timestamp) '
+                    'VALUES (?, ?) ON CONFLICT (database) '
+                    'DO UPDATE SET timestamp = excluded.timestamp',
+                    (database, watermark))
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            count += len(rows)
+    connection.execute(
+        'INSERT INTO watermark (database, refreshed) VALUES (?, ?) '
+        'ON CONFLICT (database) DO UPDATE SET refreshed = excluded.refreshed',
+        (database, started))
+    logger.debug("%s lots refreshed in the snapshot", count)
+    return count
+
+
+def discard(lot_ids):
+    "Remove the lots from the snapshot"
+    database = Transaction().database.name
+    try:
+        _connection().executemany(
+            'DELETE FROM lot WHERE database = ? AND lot = ?',
+            [(database, i) for i in lot_ids])
+    except sqlite3.Error:
+        # The entries are removed by the next refresh or expire
+        _failed('discard')
@@ -1,10 +1,25 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
-from trytond.model import ModelSQL, fields
-from trytond.pyson import Bool, Eval, If
+from collections import defaultdict
+from contextlib import contextmanager
+from weakref import WeakKeyDictionary
+from sql import For, Literal, Select
+from sql.aggregate import Sum
+from sql.conditionals import Coalesce
+from sql.functions import CurrentTimestamp
+from trytond.cache import Cache
+from trytond.config import config
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pyson import Bool, Eval, Id, If
 from trytond.pool import Pool, PoolMeta
+from trytond.rpc import RPC
+from trytond.tools import grouped_slice, reduce_ids
+from trytond.transaction import Transaction, without_check_access
 from trytond.modules.stock_scanner.stock import MIXIN_STATES
-from datetime import datetime
+from . import gs1, instrumentation
+from .instrumentation import instrumented
+from .lot import LOT_MATCHING_STRATEGIES, LotNumberAllocator
+from datetime import datetime, timedelta
 from trytond.modules.company.model import (
     CompanyMultiValueMixin, CompanyValueMixin)
 
@@ -14,6 +29,119 @@ LOT_CREATION_MODES = [
             ('always', 'Always')
             ]
 
+_move_indexes = WeakKeyDictionary()
+_any_lot = object()
+
+
+class MoveIndex(object):
+    '''
+    Pick moves of a shipment indexed by product and lot so matching a scan
+    does not have to walk and reload all the moves of the shipment.
+
+    The index is registered for the shipment while scanning and it is kept
+    up to date by the moves saved by the scanner.
+    '''
+
+    def __init__(self, moves):
+        self.moves = []
+        self._entries = {}
+        self._lots = defaultdict(dict)
+        self._pending = defaultdict(list)
+        self._not_pending = defaultdict(list)
+        self.scanned_products = set()
+        self.update(moves)
+
+    @staticmethod
+    @contextmanager
+    def scanning():
+        "Register the indexes built inside for the rest of the scan"
+        transaction = Transaction()
+        if transaction in _move_indexes:
+            yield
+            return
+        _move_indexes[transaction] = {}
+        try:
+            yield
+        finally:
+            del _move_indexes[transaction]
+
+    @staticmethod
+    def get(shipment):
+        "Return the index registered for the shipment or None"
+        return _move_indexes.get(Transaction(), {}).get(str(shipment))
+
+    def register(self, shipment):
+        indexes = _move_indexes.get(Transaction())
+        if indexes is not None:
+            indexes[str(shipment)] = self
+
+    def update(self, moves):
+        "Add the moves to the index or move them to their current key"
+        for move in moves:
+            entry = self._entries.get(id(move))
+            if entry is None:
+                sequence = len(self.moves)
+                self.moves.append(move)
+            else:
+                sequence, key, pending = entry
+                bucket = self._pending if pending else self._not_pending
+                bucket[key].remove(move)
+            key = (move.product, move.lot)
+            pending = move.pending_quantity > 0
+            self._lots[key[0]].setdefault(key[1])
+            bucket = self._pending if pending else self._not_pending
+            bucket[key].append(move)
+            self._entries[id(move)] = sequence, key, pending
+
+    def _sorted(self, moves):
+        return sorted(moves, key=lambda m: self._entries[id(m)][0])
+
+    def pending(self, product, lot=_any_lot):
+        "Return the pending moves of the product and the lot"
+        if lot is not _any_lot:
+            return self._sorted(self._pending.get((product, lot), []))
+        return self._sorted(m for l in self._lots.get(product, {})
+            for m in self._pending.get((product, l), ()))
+
+    def not_pending(self, product, lot):
+        "Return the moves of the product and the lot without pending quantity"
+        return list(self._not_pending.get((product, lot), []))
+
+    def save_moves(self, moves):
+        pool = Pool()
+        Move = pool.get('stock.move')
+        Move.save(moves)
+        self.update(moves)
+
+    def save_totals(self, shipment):
+        "Update the totals of the shipment for the scanned products"
+        pool = Pool()
+        Total = pool.get('stock.scanner.lot.total')
+        Total.update_shipment(shipment, self.moves, self.scanned_products)
+        self.scanned_products.clear()
+
+
+class ScanBatch(MoveIndex):
+    '''
+    Move index of a batch of scans which keeps the created lots and the
+    modified moves to save them all at once when the batch is finished.
+    '''
+
+    def __init__(self, moves):
+        self.lots = []
+        self.to_save = []
+        self._to_save_ids = set()
+        super(ScanBatch, self).__init__(moves)
+
+    def save_moves(self, moves):
+        for move in moves:
+            move.pending_quantity = move.unit.round(
+                move.quantity - (move.scanned_quantity or 0))
+            if id(move) not in self._to_save_ids:
+                self._to_save_ids.add(id(move))
+                self.to_save.append(move)
+        self.update(moves)
+
 
 class Configuration(CompanyMultiValueMixin, metaclass=PoolMeta):
     __name__ = 'stock.configuration'
@@ -25,11 +153,50 @@ class Configuration(CompanyMultiValueMixin, metaclass=PoolMeta):
             'found. If set to "Always" it will create a lot even if one with the '
             'same number exists. All this always takes place if a scanned lot is '
             'not selected.'))
+    scanner_lot_sequence = fields.MultiValue(fields.Many2One(
+            'ir.sequence', 'Scanner Lot Sequence', domain=[
+                ('sequence_type', '=',
+                    Id('stock_lot', 'sequence_type_stock_lot')),
+                ('company', 'in',
+                    [Eval('context', {}).get('company', -1), None]),
+                ],
+            help='The sequence used to number the lots created by the scanner '
+            'when no lot number is scanned.\n'
+            'The numbers are reserved by blocks so their prefix and suffix '
+            'dates are the ones of the reservation.'))
+    scanner_lot_consolidate = fields.MultiValue(fields.Boolean(
+            'Consolidate Scanned Moves',
+            help='If checked, the scans of a lot are added to the move of the '
+            'shipment with the same product, lot and origin instead of '
+            'creating a new move.'))
+    scanner_lot_queue = fields.MultiValue(fields.Boolean(
+            'Process Scans in Queue',
+            help='If checked, the scans are stored in the scanner lot journal '
+            'and processed by the queue workers in the order they were done.'))
+    scanner_lot_matching = fields.MultiValue(fields.Selection(
+            LOT_MATCHING_STRATEGIES, 'Lot Matching',
+            help='How the scanned lot number is matched with the existing '
+            'lots when no lot has exactly the same number: ignoring the '
+            'spaces, the case and the leading zeros, then also by the '
+            'beginning of the number and then also by similarity. Only the '
+            'exact and normalized matches are used as the scanned lot, the '
+            'others are proposed as candidates.'))
+    _scanner_settings_cache = Cache(
+        'stock.configuration.scanner_settings', context=False)
+
+    @classmethod
+    def __setup__(cls):
+        super(Configuration, cls).__setup__()
+        cls.__rpc__.update({
+                'get_scanner_statistics': RPC(),
+                })
 
     @classmethod
     def multivalue_model(cls, field):
         pool = Pool()
-        if field == 'scanner_lot_creation':
+        if field in {'scanner_lot_creation', 'scanner_lot_sequence',
+                'scanner_lot_consolidate', 'scanner_lot_queue',
+                'scanner_lot_matching'}:
             return pool.get('stock.configuration.scanner_lot_creation')
         return super(Configuration, cls).multivalue_model(field)
 
@@ -38,6 +205,51 @@ class Configuration(CompanyMultiValueMixin, metaclass=PoolMeta):
         model = cls.multivalue_model('scanner_lot_creation')
         return model.default_scanner_lot_creation()
 
+    @classmethod
+    def default_scanner_lot_matching(cls, **pattern):
+        model = cls.multivalue_model('scanner_lot_matching')
+        return model.default_scanner_lot_matching()
+
+    @classmethod
+    def get_scanner_settings(cls, product):
+        '''
+        Return a dictionary with the scanner settings for the product in the
+        company of the context:
+            - lot_creation: the lot creation mode
+            - lot_sequence: the id of the sequence to number the lots
+            - consolidate: if the scans are added to the existing moves
+            - lot_matching: the strategy to match the scanned lot numbers
+            - queue: if the scans are processed in the queue
+            - lot_required: the lot required types of the product template,
+              empty without product
+        '''
+        company_id = Transaction().context.get('company')
+        key = (company_id, product.template.id if product else None)
+        settings = cls._scanner_settings_cache.get(key)
+        if settings is None:
+            config = cls(1)
+            settings = {
+                'lot_creation': config.scanner_lot_creation,
+                'lot_sequence': (config.scanner_lot_sequence.id
+                    if config.scanner_lot_sequence else None),
+                'consolidate': bool(config.scanner_lot_consolidate),
+                'lot_matching': config.scanner_lot_matching or 'exact',
+                'queue': bool(config.scanner_lot_queue),
+                'lot_required': tuple(
+                    (product.template.lot_required or []) if product else []),
+                }
+            cls._scanner_settings_cache.set(key, settings)
+        return settings
+
+    @classmethod
+    def get_scanner_statistics(cls):
+        '''
+        Return the count and the 50th, 95th and 99th percentiles of the
+        duration in seconds and of the queries of each stage of the scans by
+        shipment model, when the instrumentation is enabled.
+        '''
+        return instrumentation.statistics()
+
 
 class ConfigurationScannerLotCreation(ModelSQL, CompanyValueMixin):
     'Stock Configuration Scanner Lot Creation'
@@ -45,11 +257,47 @@ class ConfigurationScannerLotCreation(ModelSQL, CompanyValueMixin):
 
     scanner_lot_creation = fields.Selection(
         LOT_CREATION_MODES, 'Lot Creation')
+    scanner_lot_sequence = fields.Many2One(
+        'ir.sequence', 'Scanner Lot Sequence', domain=[
+            ('sequence_type', '=',
+                Id('stock_lot', 'sequence_type_stock_lot')),
+            ('company', 'in', [Eval('company', -1), None]),
+            ])
+    scanner_lot_consolidate = fields.Boolean('Consolidate Scanned Moves')
+    scanner_lot_queue = fields.Boolean('Process Scans in Queue')
+    scanner_lot_matching = fields.Selection(
+        LOT_MATCHING_STRATEGIES, 'Lot Matching')
 
     @classmethod
     def default_scanner_lot_creation(cls):
         return None
 
+    @classmethod
+    def default_scanner_lot_matching(cls):
+        return 'exact'
+
+    @classmethod
+    def create(cls, vlist):
+        pool = Pool()
+        Configuration = pool.get('stock.configuration')
+        records = super(ConfigurationScannerLotCreation, cls).create(vlist)
+        Configuration._scanner_settings_cache.clear()
+        return records
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        Configuration = pool.get('stock.configuration')
+        super(ConfigurationScannerLotCreation, cls).write(*args)
+        Configuration._scanner_settings_cache.clear()
+
+    @classmethod
+    def delete(cls, records):
+        pool = Pool()
+        Configuration = pool.get('stock.configuration')
+        super(ConfigurationScannerLotCreation, cls).delete(records)
+        Configuration._scanner_settings_cache.clear()
+
 
 class StockScanMixin(object):
     __slots__ = ()
@@ -64,11 +312,305 @@ class StockScanMixin(object):
                 ()),
             ],
         states=MIXIN_STATES)
+    scanned_barcode = fields.Char('Scanned Barcode', states=MIXIN_STATES,
+        help='GS1-128 or GS1 DataMatrix barcode which fills the product, the '
+        'lot and the quantity to scan.')
+    scanned_expiration_date = fields.Date('Scanned Expiration Date',
+        states=MIXIN_STATES,
+        help='The expiration date of the lot created by the scan.')
+    scanned_package = fields.Many2One('stock.scanner.lot.package',
+        'Scanned Package', domain=[
+            ('shipment', '=', None),
+            ],
+        states=MIXIN_STATES,
+        help='The package or pallet whose whole content is scanned.')
+    scanner_processing = fields.Function(fields.Boolean('Processing Scans',
+            help='Scans of the shipment are waiting to be processed.'),
+        'get_scanner_processing')
+    scanner_errors = fields.Function(fields.One2Many(
+            'stock.scanner.lot.journal', None, 'Scan Errors',
+            help='The scans of the shipment which failed to be processed.'),
+        'get_scanner_errors')
+    scanner_totals = fields.One2Many('stock.scanner.lot.total', 'shipment',
+        'Scanner Totals', readonly=True,
+        help='The quantities expected, scanned and pending by product and '
+        'lot.')
+
+    @classmethod
+    def __setup__(cls):
+        super(StockScanMixin, cls).__setup__()
+        cls.__rpc__.update({
+                'scan_batch': RPC(readonly=False, instantiate=0),
+                'get_pending_moves_changes': RPC(instantiate=0),
+                'get_scanner_discrepancies': RPC(instantiate=0),
+                })
+        cls._buttons.update({
+                'start_scanning': {
+                    'invisible': Eval('state').in_(['done', 'cancelled']),
+                    'depends': ['state'],
+                    },
+                'reconcile_scanned_moves': {
+                    'invisible': Eval('state').in_(['done', 'cancelled']),
+                    'depends': ['state'],
+                    },
+                })
+
+    @classmethod
+    def get_scanner_processing(cls, shipments, name):
+        pool = Pool()
+        Journal = pool.get('stock.scanner.lot.journal')
+        processing = dict.fromkeys((s.id for s in shipments), False)
+        entries = Journal.search([
+                ('shipment', 'in', [str(s) for s in shipments]),
+                ('state', '=', 'pending'),
+                ])
+        for entry in entries:
+            processing[entry.shipment.id] = True
+        return processing
+
+    @classmethod
+    def get_scanner_errors(cls, shipments, name):
+        pool = Pool()
+        Journal = pool.get('stock.scanner.lot.journal')
+        errors = {s.id: [] for s in shipments}
+        for entry in Journal.search([
+                    ('shipment', 'in', [str(s) for s in shipments]),
+                    ('state', '=', 'error'),
+                    ]):
+            errors[entry.shipment.id].append(entry.id)
+        return errors
+
+    @classmethod
+    def delete(cls, shipments):
+        pool = Pool()
+        Total = pool.get('stock.scanner.lot.total')
+        Journal = pool.get('stock.scanner.lot.journal')
+        references = [str(s) for s in shipments]
+        with without_check_access():
+            Total.delete(Total.search([
+                        ('shipment', 'in', references),
+                        ]))
+            # The queued tasks of the deleted entries are skipped
+            Journal.delete(Journal.search([
+                        ('shipment', 'in', references),
+                        ('state', '=', 'pending'),
+                        ]))
+        super(StockScanMixin, cls).delete(shipments)
+
+    @classmethod
+    def get_scanner_discrepancies(cls, shipments):
+        '''
+        Return for each shipment the list of the products and lots whose
+        scanned quantity differs from the expected quantity.
+
+        The quantities of all the pick moves of the shipments are grouped by
+        product, lot and unit with a single query. Each discrepancy is a
+        dictionary with the 'product', 'lot' and 'unit' ids, the expected
+        'quantity' and the 'scanned_quantity'.
+        '''
+        pool = Pool()
+        Move = pool.get('stock.move')
+        Uom = pool.get('product.uom')
+        cursor = Transaction().connection.cursor()
+        move = Move.__table__()
+
+        move2shipment = {}
+        for shipment in shipments:
+            for pick_move in shipment.get_pick_moves():
+                move2shipment[pick_move.id] = shipment.id
+        discrepancies = {s.id: [] for s in shipments}
+        for sub_ids in grouped_slice(list(move2shipment)):
+            cursor.execute(*move.select(
+                    move.shipment, move.product, move.lot, move.unit,
+                    Sum(move.quantity),
+                    Sum(Coalesce(move.scanned_quantity, 0)),
+                    where=reduce_ids(move.id, sub_ids),
+                    group_by=[move.shipment, move.product, move.lot,
+                        move.unit]))
+            for shipment, product, lot, unit, quantity, scanned in cursor:
+                unit = Uom(unit)
+                quantity = unit.round(quantity or 0)
+                scanned = unit.round(scanned or 0)
+                if quantity != scanned:
+                    shipment_id = int(shipment.split(',')[1])
+                    discrepancies[shipment_id].append({
+                            'product': product,
+                            'lot': lot,
+                            'unit': unit.id,
+                            'quantity': quantity,
+                            'scanned_quantity': scanned,
+                            })
+        return [discrepancies[s.id] for s in shipments]
+
+    @classmethod
+    @ModelView.button
+    def reconcile_scanned_moves(cls, shipments):
+        '''
+        Set the quantity of the partially scanned draft pick moves to their
+        scanned quantity and the lot of the draft pick moves without lot when
+        it is known, with one write for each distinct quantity and lot.
+
+        The moves which were not scanned are kept with their quantity.
+        '''
+        pool = Pool()
+        Move = pool.get('stock.move')
+        to_write = defaultdict(list)
+        for shipment in shipments:
+            moves = [m for m in shipment.get_pick_moves()
+                if m.state == 'draft']
+            for move in moves:
+                scanned = move.unit.round(move.scanned_quantity or 0)
+                if scanned and scanned != move.quantity:
+                    to_write[('quantity', scanned)].append(move)
+            lots = shipment.get_reconcile_lots(moves)
+            for move in moves:
+                if move.id in lots:
+                    to_write[('lot', lots[move.id])].append(move)
+        args = []
+        for (field, value), moves in to_write.items():
+            args.extend((moves, {field: value}))
+        if args:
+            Move.write(*args)
+
+    def get_reconcile_lots(self, moves):
+        '''
+        Return the id of the lot to set on each of the moves without lot: the
+        lot of the scanned pick moves of the product when they all have the
+        same one.
+        '''
+        lots = defaultdict(set)
+        for move in self.get_pick_moves():
+            if move.scanned_quantity and move.lot:
+                lots[move.product.id].add(move.lot.id)
+        result = {}
+        for move in moves:
+            if not move.lot and len(lots[move.product.id]) == 1:
+                result[move.id], = lots[move.product.id]
+        return result
+
+    @classmethod
+    def get_pending_moves_changes(cls, shipments, since=None):
+        '''
+        Return for each shipment the pending moves modified since the
+        timestamp so the clients update their list incrementally.
+
+        Each result is a dictionary with the 'timestamp' to use for the next
+        call, the 'ids' of all the pending moves to remove the others from the
+        list and the modified 'moves' as lists of id, product id, lot id,
+        pending quantity and scanned quantity.
+
+        The moves modified during the "pending_moves_margin" seconds before
+        the timestamp, set in the [stock_scanner_lot] section of the trytond
+        configuration, are returned again to catch the transactions which
+        started before the previous call but committed after it.
+        '''
+        pool = Pool()
+        Move = pool.get('stock.move')
+        cursor = Transaction().connection.cursor()
+
+        # Use now from the transaction to compare with the write dates
+        timestamp_cast = Move.write_date.sql_cast
+        cursor.execute(*Select([timestamp_cast(CurrentTimestamp())]))
+        now, = cursor.fetchone()
+        if isinstance(now, str):
+            now = datetime.fromisoformat(now)
+        if since is not None:
+            since -= timedelta(seconds=config.getint(
+                    'stock_scanner_lot', 'pending_moves_margin', default=60))
+
+        changes = []
+        for shipment in shipments:
+            moves = [m for m in shipment.get_pick_moves()
+                if m.pending_quantity]
+            changes.append({
+                    'timestamp': now,
+                    'ids': [m.id for m in moves],
+                    'moves': [[
+                            m.id, m.product.id, m.lot.id if m.lot else None,
+                            m.pending_quantity, m.scanned_quantity]
+                        for m in moves
+                        if since is None
+                        or (m.write_date or m.create_date) >= since],
+                    })
+        return changes
+
+    @classmethod
+    @ModelView.button
+    def start_scanning(cls, shipments):
+        '''
+        Load the lots which may be scanned on the shipments in the lot number
+        cache so the lookups of the scans are answered from memory and compute
+        again their scanner totals.
+        '''
+        pool = Pool()
+        Lot = pool.get('stock.lot')
+        Total = pool.get('stock.scanner.lot.total')
+        for shipment in shipments:
+            Lot.prefetch_scanner_lots(shipment.get_scanner_candidate_lots())
+        # The shipments created before the totals were kept in sync
+        Total.refresh(shipments)
+
+    def get_scanner_candidate_lots(self):
+        '''
+        Return the lots of the products of the shipment which may be scanned:
+        the lots of the moves with the same origins, the lots with stock in
+        the source locations and the lots created recently.
+
+        The number of lots and the days of the recent lots are set with the
+        "prefetch_lots" and "prefetch_days" keys of the [stock_scanner_lot]
+        section of the trytond configuration.
+        '''
+        pool = Pool()
+        Date = pool.get('ir.date')
+        Lot = pool.get('stock.lot')
+        Move = pool.get('stock.move')
+        Product = pool.get('product.product')
+
+        size = config.getint('stock_scanner_lot', 'prefetch_lots',
+            default=1000)
+        days = config.getint('stock_scanner_lot', 'prefetch_days',
+            default=30)
+        moves = self.get_pick_moves()
+        product_ids = list({m.product.id for m in moves})
+        if not product_ids or not size:
+            return []
+
+        lot_ids = {m.lot.id for m in moves if m.lot}
+        origins = list({str(m.origin) for m in moves if m.origin})
+        if origins:
+            lot_ids.update(m.lot.id for m in Move.search([
+                        ('origin', 'in', origins),
+                        ('lot', '!=', None),
+                        ]))
+        location_ids = list({m.from_location.id for m in moves
+                if m.from_location.type == 'storage'})
+        if location_ids:
+            with Transaction().set_context(stock_date_end=Date.today()):
+                quantities = Product.products_by_location(location_ids,
+                    with_childs=True, grouping=('product', 'lot'),
+                    grouping_filter=(product_ids,))
+            lot_ids.update(k[2] for k, quantity in quantities.items()
+                if k[2] and quantity > 0)
+        recent = datetime.now() - timedelta(days=days)
+        return Lot.search([
+                ('product', 'in', product_ids),
+                ['OR',
+                    ('id', 'in', list(lot_ids)),
+                    ('create_date', '>=', recent),
+                    ],
+                ], limit=size, order=[('create_date', 'DESC'), ('id', 'DESC')])
 
     def clear_scan_values(self):
         super(StockScanMixin, self).clear_scan_values()
+        self.scanned_barcode = None
         self.scanned_lot_number = None
         self.scanned_lot = None
+        self.scanned_package = None
+        self.scanned_expiration_date = None
+        index = MoveIndex.get(self)
+        # The moves of the batches update the totals when they are saved
+        if index is not None and not isinstance(index, ScanBatch):
+            index.save_totals(self)
 
     def get_processed_move(self):
         move = super(StockScanMixin, self).get_processed_move()
@@ -82,58 +624,143 @@ class StockScanMixin(object):
 
     @fields.depends('scanned_lot', 'scanned_lot_number', 'scanned_product')
     def on_change_scanned_lot_number(self):
+        if not self.scanned_lot and self.scanned_lot_number:
+            self.scanned_lot = self._get_scanned_lot()
+
+    @fields.depends('scanned_barcode', 'scanned_product', 'scanned_quantity',
+        'scanned_lot', 'scanned_lot_number', 'scanned_package',
+        'scanned_expiration_date')
+    def on_change_scanned_barcode(self):
+        if not self.scanned_barcode:
+            return
+        try:
+            values = gs1.parse(self.scanned_barcode)
+        except gs1.GS1Error:
+            return
+        self.set_scanned_gs1(values)
+
+    def set_scanned_gs1(self, values):
+        "Fill the scan values with the values of a GS1 barcode"
         pool = Pool()
+        Package = pool.get('stock.scanner.lot.package')
+        Product = pool.get('product.product')
+        if values.get('sscc'):
+            self.scanned_package = Package.get_scanner_package(values['sscc'])
+        gtin = values.get('gtin')
+        if gtin:
+            codes = [gtin]
+            if gtin.startswith('0'):
+                codes.append(gtin[1:])
+            products = Product.search([
+                    ('identifiers.code', 'in', codes),
+                    ], limit=1)
+            if products:
+                self.scanned_product, = products
+        if values.get('lot'):
+            self.scanned_lot = None
+            self.scanned_lot_number = values['lot']
+            self.scanned_lot = self._get_scanned_lot()
+        quantity = values.get('count') or values.get('quantity')
+        if quantity:
+            self.scanned_quantity = quantity
+        if values.get('expiration_date'):
+            self.scanned_expiration_date = values['expiration_date']
+
+    @instrumented('lot_lookup')
+    def _get_scanned_lot(self):
+        "Return the scanned lot or the lot found with the scanned number"
+        pool = Pool()
+        Config = pool.get('stock.configuration')
         Lot = pool.get('stock.lot')
-        if not self.scanned_lot and self.scanned_lot_number:
-            lots = Lot.search([
-                ('number', '=', self.scanned_lot_number),
-                ('product', '=', self.scanned_product)
-                ], limit=1)
-            if lots:
-                self.scanned_lot, = lots
+        if self.scanned_lot:
+            return self.scanned_lot
+        if not self.scanned_product or not self.scanned_lot_number:
+            return
+        settings = Config.get_scanner_settings(self.scanned_product)
+        return Lot.find_scanner_lot(self.scanned_product,
+            self.scanned_lot_number, settings['lot_matching'])
 
+    @instrumented('adjust_pending_moves')
     def _adjust_pending_moves(self):
         """
-        If there aren't matching moves, a new one is created, then the amount
-        of one of the pending movements must be adjusted with the coincidence
-        of the product and the amount pending.
+        If there aren't matching moves, a new one is created, then the scanned
+        quantity must be deducted from the pending movements of the product:
+        from the first one with enough pending quantity or else split over
+        several of them.
         """
-        for move in self.pending_moves:
-            if (move.product == self.scanned_product
-                    and (move.pending_quantity - self.scanned_quantity) >= 0):
-                move.quantity -= self.scanned_quantity
-                move.save()
-                return move
+        index = self._get_move_index()
+        pending_moves = index.pending(self.scanned_product)
+        allocation = self._allocate_scanned_quantity(
+            pending_moves, self.scanned_quantity)
+        for move, quantity in allocation:
+            move.quantity = move.unit.round(move.quantity - quantity)
+        if allocation:
+            self._save_scanned_moves([m for m, _ in allocation])
+            return allocation[0][0]
+
+    @staticmethod
+    def _allocate_scanned_quantity(moves, quantity):
+        '''
+        Return the list of moves and quantities to deduct to allocate the
+        quantity over the pending quantity of the moves.
+
+        The first move with enough pending quantity takes all the quantity,
+        otherwise the moves are filled in order until the quantity is
+        allocated, rounded with the unit of each move.
+        '''
+        for move in moves:
+            if (move.pending_quantity - quantity) >= 0:
+                return [(move, quantity)]
+        allocation = []
+        for move in moves:
+            if quantity <= 0:
+                break
+            allocated = move.unit.round(min(move.pending_quantity, quantity))
+            if allocated > 0:
+                allocation.append((move, allocated))
+                quantity = move.unit.round(quantity - allocated)
+        return allocation
 
     def _is_needed_to_create_lot(self, moves=None):
         return False
 
+    def _get_move_index(self):
+        "Return the index of the pick moves registered for the shipment"
+        index = MoveIndex.get(self)
+        if index is None:
+            index = MoveIndex(self.get_pick_moves())
+            index.register(self)
+        return index
+
+    @instrumented('matching_moves')
     def get_matching_moves(self):
         """Get possible scanned move"""
+        index = self._get_move_index()
+        self.pending_moves = index.pending(self.scanned_product)
         moves = super(StockScanMixin, self).get_matching_moves()
         match_moves = []
         w_lot_moves = []
         if self.scanned_lot_number:
+            if not self.scanned_lot:
+                self.scanned_lot = self._get_scanned_lot()
             if self._is_needed_to_create_lot(moves):
                 return []
-            for move in moves:
-                if move.lot and self.scanned_lot == move.lot:
-                    match_moves.append(move)
-                elif not move.lot and not move.scanned_quantity:
-                    w_lot_moves.append(move)
+            candidates = set(moves)
+            if self.scanned_lot:
+                match_moves = [m for m in index.pending(
+                        self.scanned_product, self.scanned_lot)
+                    if m in candidates]
+            w_lot_moves = [m for m in index.pending(self.scanned_product, None)
+                if m in candidates and not m.scanned_quantity]
 
             if not match_moves:
-                no_pending_moves = list(set(self.get_pick_moves()) -
-                    set(self.pending_moves))
-                for move in no_pending_moves:
-                    if (move.product == self.scanned_product and
-                            move.lot == self.scanned_lot):
-                        match_moves.append(move)
-                        break
+                match_moves = index.not_pending(
+                    self.scanned_product, self.scanned_lot)[:1]
             return match_moves or w_lot_moves
 
         return moves
 
+    @instrumented('process_moves')
     def process_moves(self, moves):
         is_not_pending_move = len(moves) == 1 and not moves[0].pending_quantity
         adjusted_move = None
@@ -148,13 +775,241 @@ class StockScanMixin(object):
             move.origin = adjusted_move.origin
         if not move.lot:
             move.lot = self.scanned_lot
-        move.save()
+        if move.id is None or move.id < 0:
+            move = self._consolidate_move(move)
+        self._save_scanned_moves([move])
+        index = self._get_move_index()
+        index.update(moves)
+        index.scanned_products.add(move.product)
+        return move
+
+    def _consolidate_move(self, move):
+        '''
+        Return the scanned move of the shipment with the same product, lot
+        and origin with the quantities of the new move added or the new move
+        if the consolidation is not activated or there is no such move.
+        '''
+        pool = Pool()
+        Config = pool.get('stock.configuration')
+        settings = Config.get_scanner_settings(move.product)
+        if not settings['consolidate'] or not move.lot:
+            return move
+        index = self._get_move_index()
+        for other in index.not_pending(move.product, move.lot):
+            if other.id is not None and other.id < 0:
+                continue
+            if self._consolidation_key(other) == self._consolidation_key(move):
+                other.quantity += move.quantity
+                other.scanned_quantity = ((other.scanned_quantity or 0)
+                    + (move.scanned_quantity or 0))
+                return other
         return move
 
+    @staticmethod
+    def _consolidation_key(move):
+        return (move.product, move.lot, move.origin, move.from_location,
+            move.to_location, move.unit, getattr(move, 'unit_price', None))
+
+    @staticmethod
+    def _get_scanned_lock_ids(shipments, product_ids):
+        "Return the sorted ids of the pick moves of the scanned products"
+        return sorted({m.id for s in shipments for m in s.get_pick_moves()
+                if m.product.id in product_ids and m.id >= 0})
+
+    @classmethod
+    @instrumented('lock')
+    def _lock_scanned_moves(cls, shipments, product_ids):
+        '''
+        Lock the pick moves of the scanned products before scanning them.
+
+        The lock waits for the scans of the same products on the same
+        shipments, which fail to serialize once committed so the dispatcher
+        retries the transaction with their quantities. The scans of the
+        other products are not serialized. The moves are locked in the order
+        of their ids to avoid deadlocks.
+        '''
+        pool = Pool()
+        Move = pool.get('stock.move')
+        transaction = Transaction()
+        if not transaction.database.has_select_for():
+            return
+        move = Move.__table__()
+        cursor = transaction.connection.cursor()
+        for sub_ids in grouped_slice(
+                cls._get_scanned_lock_ids(shipments, product_ids)):
+            cursor.execute(*move.select(Literal(1),
+                    where=reduce_ids(move.id, sub_ids),
+                    order_by=[move.id.asc],
+                    for_=For('UPDATE')))
+
+    @instrumented('save')
+    def _save_scanned_moves(self, moves):
+        self._get_move_index().save_moves(moves)
+
+    @classmethod
+    @ModelView.button
+    @instrumented('scan')
+    def scan(cls, shipments):
+        pool = Pool()
+        Config = pool.get('stock.configuration')
+        if Config.get_scanner_settings(None)['queue']:
+            cls._queue_scans(shipments)
+            return
+        product_ids = set()
+        for shipment in shipments:
+            if shipment.scanned_package:
+                product_ids.update(
+                    l.product.id for l in shipment.scanned_package.lines)
+            elif shipment.scanned_product and shipment.scanned_quantity:
+                product_ids.add(shipment.scanned_product.id)
+        cls._lock_scanned_moves(shipments, product_ids)
+        packages = [s for s in shipments if s.scanned_package]
+        if packages:
+            cls.scan_packages(packages)
+            shipments = [s for s in shipments if s not in packages]
+        with MoveIndex.scanning():
+            super(StockScanMixin, cls).scan(shipments)
+
+    @classmethod
+    def scan_packages(cls, shipments):
+        '''
+        Process the content of the scanned package of each shipment as a
+        batch of scans and link the packages to their shipment.
+        '''
+        pool = Pool()
+        Package = pool.get('stock.scanner.lot.package')
+        packages = []
+        for shipment in shipments:
+            package = shipment.scanned_package
+            shipment.clear_scan_values()
+            cls.scan_batch([shipment], package.get_scans())
+            package.shipment = shipment
+            packages.append(package)
+        Package.save(packages)
+        cls.save(shipments)
+
+    def _get_scan_journal(self):
+        "Return the journal entry of the scan"
+        pool = Pool()
+        Journal = pool.get('stock.scanner.lot.journal')
+        return Journal(
+            shipment=self,
+            product=self.scanned_product,
+            lot=self.scanned_lot,
+            lot_number=self.scanned_lot_number,
+            quantity=self.scanned_quantity,
+            expiration_date=self.scanned_expiration_date,
+            device=Transaction().context.get('scanner_device'))
+
+    def _get_package_journal(self):
+        "Return the journal entries of the content of the scanned package"
+        pool = Pool()
+        Journal = pool.get('stock.scanner.lot.journal')
+        timestamp = Journal.default_timestamp()
+        entries = []
+        for sequence, scan in enumerate(self.scanned_package.get_scans()):
+            entries.append(Journal(
+                    shipment=self,
+                    product=scan['product'],
+                    lot=scan.get('lot'),
+                    lot_number=scan.get('lot_number'),
+                    quantity=scan['quantity'],
+                    expiration_date=scan.get('expiration_date'),
+                    device=Transaction().context.get('scanner_device'),
+                    timestamp=timestamp,
+                    sequence=sequence))
+        return entries
+
+    @classmethod
+    def _queue_scans(cls, shipments):
+        '''
+        Store the scans in the journal and queue their processing so they are
+        replayed in order for each shipment.
+        '''
+        pool = Pool()
+        Journal = pool.get('stock.scanner.lot.journal')
+        Package = pool.get('stock.scanner.lot.package')
+        entries, packages = [], []
+        for shipment in shipments:
+            if shipment.scanned_package:
+                entries.extend(shipment._get_package_journal())
+                shipment.scanned_package.shipment = shipment
+                packages.append(shipment.scanned_package)
+            elif shipment.scanned_product and shipment.scanned_quantity:
+                entries.append(shipment._get_scan_journal())
+            shipment.clear_scan_values()
+        Package.save(packages)
+        cls.save(shipments)
+        Journal.save(entries)
+        # A task replays all the pending entries of its shipment
+        first_entries = {}
+        for entry in entries:
+            first_entries.setdefault(str(entry.shipment), entry)
+        with Transaction().set_context(queue_name='stock_scanner_lot'):
+            for entry in first_entries.values():
+                Journal.__queue__.process_shipments([entry])
+
+    @classmethod
+    def _search_scanned_lots(cls, scans):
+        "Return a dictionary with the lot of each (product id, lot number)"
+        pool = Pool()
+        Lot = pool.get('stock.lot')
+        return Lot.search_scanner_lots(scans)
+
+    @classmethod
+    @instrumented('scan_batch')
+    def scan_batch(cls, shipments, scans):
+        '''
+        Process the scans in order on each shipment as the scan button would
+        do and save all the created lots and the modified moves at once.
+
+        Each scan is a dictionary with the keys 'product', 'quantity' and
+        optionally 'lot' or 'lot_number' and 'expiration_date'. The shipments
+        are not written so concurrent batches only lock the moves.
+        '''
+        pool = Pool()
+        Lot = pool.get('stock.lot')
+        Move = pool.get('stock.move')
+        Product = pool.get('product.product')
+
+        cls._lock_scanned_moves(shipments, {s['product'] for s in scans})
+        lots = cls._search_scanned_lots(scans)
+        to_save_lots, to_save_moves = [], []
+        for shipment in shipments:
+            with MoveIndex.scanning():
+                batch = ScanBatch(shipment.get_pick_moves())
+                batch.register(shipment)
+                for scan in scans:
+                    shipment.scanned_product = Product(scan['product'])
+                    shipment.scanned_quantity = scan.get('quantity')
+                    shipment.scanned_lot = None
+                    shipment.scanned_lot_number = scan.get('lot_number')
+                    shipment.scanned_expiration_date = scan.get(
+                        'expiration_date')
+                    if scan.get('lot'):
+                        shipment.scanned_lot = Lot(scan['lot'])
+                        shipment.on_change_scanned_lot()
+                    elif shipment.scanned_lot_number:
+                        shipment.scanned_lot = lots.get(
+                            (scan['product'], shipment.scanned_lot_number))
+                    if shipment.scanned_quantity:
+                        moves = shipment.get_matching_moves()
+                        shipment.process_moves(moves)
+                        batch.save_moves(moves)
+                        for lot in batch.lots:
+                            lots.setdefault((lot.product.id, lot.number), lot)
+                    shipment.clear_scan_values()
+            to_save_lots.extend(batch.lots)
+            to_save_moves.extend(batch.to_save)
+        Lot.save(to_save_lots)
+        # The totals are updated by the moves saved out of the scanning
+        Move.save(to_save_moves)
+
 
 class ShipmentIn(StockScanMixin, metaclass=PoolMeta):
     __name__ = 'stock.shipment.in'
 
+    @instrumented('is_needed_to_create_lot')
     def _is_needed_to_create_lot(self, moves=None):
         pool = Pool()
         Config = pool.get('stock.configuration')
@@ -162,38 +1017,285 @@ class ShipmentIn(StockScanMixin, metaclass=PoolMeta):
         if not self.scanned_product:
             return False
 
-        config = Config(1)
-        lot_creation_method = config.scanner_lot_creation
-        lot_required = 'supplier' in (self.scanned_product.template.lot_required
-            or [])
+        settings = Config.get_scanner_settings(self.scanned_product)
+        lot_creation_method = settings['lot_creation']
+        lot_required = 'supplier' in settings['lot_required']
         return (lot_creation_method == 'always' or
-            (not self.scanned_lot and (lot_required
+            (not self._get_scanned_lot() and (lot_required
                 or (self.scanned_lot_number and lot_creation_method ==
                     'search-create'))))
 
+    @instrumented('create_lot')
     def _create_lot(self):
         pool = Pool()
         Lot = pool.get('stock.lot')
-        default_lot_number = datetime.today().strftime('%Y-%m-%d')
-        lot_number = (self.scanned_lot_number or
-            default_lot_number)
+        Config = pool.get('stock.configuration')
+        settings = Config.get_scanner_settings(self.scanned_product)
+        lot_number = self.scanned_lot_number
+        if not lot_number:
+            if settings['lot_sequence']:
+                lot_number = LotNumberAllocator.get(settings['lot_sequence'])
+            else:
+                lot_number = datetime.today().strftime('%Y-%m-%d')
         lot = Lot()
         lot.product = self.scanned_product
         lot.number = lot_number
+        lot.scanner_always = settings['lot_creation'] == 'always'
+        # The expiration dates are defined by stock_lot_sle
+        template = self.scanned_product.template
+        for field, time in [
+                ('shelf_life_expiration_date', 'shelf_life_time'),
+                ('expiration_date', 'expiration_time'),
+                ]:
+            if hasattr(Lot, field):
+                setattr(lot, field,
+                    self._get_lot_expiration_date(
+                        getattr(template, time, None)))
+        if self.scanned_expiration_date and hasattr(Lot, 'expiration_date'):
+            lot.expiration_date = self.scanned_expiration_date
         return lot
 
+    def _get_lot_expiration_date(self, days):
+        "Return the date after the days from today or None"
+        pool = Pool()
+        Date = pool.get('ir.date')
+        if days:
+            return Date.today() + timedelta(days=days)
+
+    @classmethod
+    def __setup__(cls):
+        super(ShipmentIn, cls).__setup__()
+        cls._buttons.update({
+                'compact_scanned_moves': {
+                    'invisible': Eval('state') != 'draft',
+                    'depends': ['state'],
+                    },
+                })
+
+    @classmethod
+    @ModelView.button
+    def compact_scanned_moves(cls, shipments):
+        '''
+        Merge the draft incoming moves of the shipments with the same product,
+        lot, origin, locations, unit and unit price into a single move.
+        '''
+        pool = Pool()
+        Move = pool.get('stock.move')
+        to_save, to_delete = set(), []
+        for shipment in shipments:
+            moves = {}
+            for move in shipment.incoming_moves:
+                if move.state != 'draft':
+                    continue
+                key = cls._consolidation_key(move)
+                if key not in moves:
+                    moves[key] = move
+                    continue
+                other = moves[key]
+                other.quantity += move.quantity
+                other.scanned_quantity = ((other.scanned_quantity or 0)
+                    + (move.scanned_quantity or 0))
+                to_save.add(other)
+                to_delete.append(move)
+        Move.save(list(to_save))
+        Move.delete(to_delete)
+
     def process_moves(self, moves):
         if not self.scanned_lot and self._is_needed_to_create_lot(moves):
             lot = self._create_lot()
             self.scanned_lot = lot
-            self.save()
+            batch = MoveIndex.get(self)
+            if isinstance(batch, ScanBatch):
+                batch.lots.append(lot)
+            else:
+                self.save()
             moves = []
         return super(ShipmentIn, self).process_moves(moves)
 
 
+class ShipmentInReturn(StockScanMixin, metaclass=PoolMeta):
+    __name__ = 'stock.shipment.in.return'
+
+
+class ShipmentInternal(StockScanMixin, metaclass=PoolMeta):
+    __name__ = 'stock.shipment.internal'
+
+
 class ShipmentOut(StockScanMixin, metaclass=PoolMeta):
     __name__ = 'stock.shipment.out'
 
+    @classmethod
+    @ModelView.button
+    def start_scanning(cls, shipments):
+        super(ShipmentOut, cls).start_scanning(shipments)
+        cls.suggest_scanner_lots(shipments)
+
+    @classmethod
+    def suggest_scanner_lots(cls, shipments):
+        '''
+        Store on the pending moves without lot of the shipments the lot to
+        pick, with one write for each lot.
+        '''
+        pool = Pool()
+        Move = pool.get('stock.move')
+        to_write = defaultdict(list)
+        for shipment in shipments:
+            # The returns inherit the customer shipments but pick nothing
+            if shipment.__name__ != 'stock.shipment.out':
+                continue
+            suggestions = shipment.get_lot_suggestions()
+            for move in shipment.pending_moves:
+                if move.lot:
+                    continue
+                lot_id = suggestions.get(move.id)
+                current = move.scanner_suggested_lot
+                if (current.id if current else None) != lot_id:
+                    to_write[lot_id].append(move)
+        args = []
+        for lot_id, moves in to_write.items():
+            args.extend((moves, {'scanner_suggested_lot': lot_id}))
+        if args:
+            Move.write(*args)
+
+    def get_lot_suggestions(self):
+        '''
+        Return the id of the lot to pick for each pending move without lot.
+
+        The available lots of each product and location are computed with a
+        single quantity query for the whole shipment and they are ranked
+        by expiration date (FEFO) or by creation date (FIFO).
+        '''
+        pool = Pool()
+        Date = pool.get('ir.date')
+        Lot = pool.get('stock.lot')
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+
+        moves = [m for m in self.pending_moves if not m.lot]
+        if not moves:
+            return {}
+        location_ids = list({m.from_location.id for m in moves})
+        product_ids = list({m.product.id for m in moves})
+        with Transaction().set_context(stock_date_end=Date.today()):
+            quantities = Product.products_by_location(location_ids,
+                with_childs=True, grouping=('product', 'lot'),
+                grouping_filter=(product_ids,))
+
+        available = {}
+        for (location_id, product_id, lot_id), quantity in (
+                quantities.items()):
+            if lot_id and quantity > 0:
+                available[(location_id, product_id, lot_id)] = quantity
+        lots = defaultdict(list)
+        for lot in sorted(Lot.browse(list({k[2] for k in available})),
+                key=self._lot_suggestion_key):
+            lots[lot.product.id].append(lot.id)
+
+        return self._allocate_suggested_lots([
+                (m, Uom.compute_qty(m.unit, m.pending_quantity,
+                        m.product.default_uom, round=False))
+                for m in moves], lots, available)
+
+    @staticmethod
+    def _allocate_suggested_lots(moves, lots, available):
+        '''
+        Return the id of the lot to pick for each move and quantity from the
+        ranked lot ids of each product id.
+
+        The first lot with available quantity in the location of the move is
+        suggested and its quantity by location, product and lot id is
+        decreased so the next moves suggest the next lots.
+        '''
+        suggestions = {}
+        for move, quantity in moves:
+            for lot_id in lots.get(move.product.id, []):
+                key = (move.from_location.id, move.product.id, lot_id)
+                if available.get(key, 0) > 0:
+                    suggestions[move.id] = lot_id
+                    available[key] -= quantity
+                    break
+        return suggestions
+
+    def get_reconcile_lots(self, moves):
+        lots = super(ShipmentOut, self).get_reconcile_lots(moves)
+        for move in moves:
+            if not move.lot and move.scanner_suggested_lot:
+                lots.setdefault(move.id, move.scanner_suggested_lot.id)
+        return lots
+
+    @staticmethod
+    def _lot_suggestion_key(lot):
+        expiration_date = getattr(lot, 'expiration_date', None)
+        return (expiration_date or datetime.max.date(), lot.create_date,
+            lot.id)
+
+
+class Move(metaclass=PoolMeta):
+    __name__ = 'stock.move'
+
+    scanner_suggested_lot = fields.Many2One('stock.lot', 'Suggested Lot',
+        readonly=True, ondelete='SET NULL',
+        help='The lot to pick first according to its expiration or '
+        'creation date, computed when the scanning starts.')
+    # The fields which change the scanner totals or the pick moves
+    _scanner_totals_fields = {
+        'product', 'lot', 'unit', 'quantity', 'scanned_quantity', 'state',
+        'shipment', 'from_location', 'to_location',
+        }
+
+    @classmethod
+    def _get_scanner_totals_products(cls, moves):
+        '''
+        Return the products of the moves by shipment with scanner totals.
+
+        The shipments being scanned are skipped as the scanner updates their
+        totals at the end of the scan.
+        '''
+        products = defaultdict(set)
+        for move in moves:
+            shipment = move.shipment
+            if (isinstance(shipment, StockScanMixin) and shipment.id >= 0
+                    and MoveIndex.get(shipment) is None):
+                products[str(shipment)].add(move.product)
+        return products
+
+    @classmethod
+    def _update_scanner_totals(cls, products):
+        pool = Pool()
+        Total = pool.get('stock.scanner.lot.total')
+        for shipment, shipment_products in products.items():
+            name, id_ = shipment.split(',')
+            shipment = pool.get(name)(int(id_))
+            Total.update_shipment(
+                shipment, shipment.get_pick_moves(), shipment_products)
+
+    @classmethod
+    def create(cls, vlist):
+        moves = super(Move, cls).create(vlist)
+        cls._update_scanner_totals(cls._get_scanner_totals_products(moves))
+        return moves
+
+    @classmethod
+    def write(cls, *args):
+        moves = []
+        actions = iter(args)
+        for records, values in zip(actions, actions):
+            if cls._scanner_totals_fields & set(values):
+                moves.extend(records)
+        products = cls._get_scanner_totals_products(moves)
+        super(Move, cls).write(*args)
+        moves = cls.browse(moves)
+        for shipment, shipment_products in (
+                cls._get_scanner_totals_products(moves).items()):
+            products[shipment].update(shipment_products)
+        cls._update_scanner_totals(products)
+
+    @classmethod
+    def delete(cls, moves):
+        products = cls._get_scanner_totals_products(moves)
+        super(Move, cls).delete(moves)
+        cls._update_scanner_totals(products)
+
 
 class ShipmentOutReturn(ShipmentOut, metaclass=PoolMeta):
     __name__ = 'stock.shipment.out.return'
@@ -1,14 +1,772 @@
-
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+import datetime
+import os
+import tempfile
+from contextlib import nullcontext
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import patch
 
-from trytond.modules.company.tests import CompanyTestMixin
-from trytond.tests.test_tryton import ModuleTestCase
+from trytond.exceptions import UserError
+from trytond.model import Index
+from trytond.modules.company.tests import (
+    CompanyTestMixin, create_company, set_company)
+from trytond.modules.stock_scanner_lot import (
+    gs1, instrumentation, snapshot)
+from trytond.modules.stock_scanner_lot.lot import (
+    LotNumberAllocator, _modified_lots, normalize_lot_number)
+from trytond.modules.stock_scanner_lot.stock import (
+    ShipmentOut, StockScanMixin)
+from trytond.pool import Pool
+from trytond.tests.test_tryton import ModuleTestCase, with_transaction
+from trytond.transaction import Transaction
 
 
 class StockScannerLotTestCase(CompanyTestMixin, ModuleTestCase):
     'Test StockScannerLot module'
     module = 'stock_scanner_lot'
+    extras = ['stock_lot_sle']
+
+    def test_gs1_parse(self):
+        "Test parse GS1 barcode"
+        self.assertEqual(
+            gs1.parse(']C101095011010209171719050810ABCD1234\x1d3010'), {
+                'gtin': '09501101020917',
+                'expiration_date': datetime.date(2019, 5, 8),
+                'lot': 'ABCD1234',
+                'quantity': 10,
+                })
+
+    def test_gs1_parse_human_readable(self):
+        "Test parse GS1 barcode in human readable form"
+        self.assertEqual(
+            gs1.parse('(01)09501101020917(17)190500(10)ABCD1234(37)5'), {
+                'gtin': '09501101020917',
+                'expiration_date': datetime.date(2019, 5, 31),
+                'lot': 'ABCD1234',
+                'count': 5,
+                })
+
+    def test_gs1_parse_unknown(self):
+        "Test parse GS1 barcode with unknown application identifier"
+        with self.assertRaises(gs1.GS1Error):
+            gs1.parse('0109501101020917991234')
+
+    @with_transaction()
+    def test_instrumentation_queries(self):
+        "Test instrumentation counts the queries of the stages"
+        pool = Pool()
+        User = pool.get('res.user')
+
+        class Model(object):
+            __name__ = 'test'
+
+            @instrumentation.instrumented('stage')
+            def stage(self):
+                cursor = Transaction().connection.cursor()
+                cursor.execute('SELECT 1')
+                cursor.execute('SELECT 2')
+                User.search([], limit=1)
+
+        with patch.dict(instrumentation._state, {'enabled': True}):
+            instrumentation._count_queries()
+            instrumentation.reset()
+            Model().stage()
+            statistics, = instrumentation.statistics()
+            instrumentation.reset()
+
+        self.assertEqual(statistics['model'], 'test')
+        self.assertEqual(statistics['stage'], 'stage')
+        self.assertEqual(statistics['count'], 1)
+        self.assertEqual(statistics['queries_p50'], 3)
+
+    @with_transaction()
+    def test_template_write_scanner_settings_cache(self):
+        "Test template write clears scanner settings only for lot required"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Configuration = pool.get('stock.configuration')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name='Product', type='goods', default_uom=unit)
+        template.save()
+
+        with patch.object(
+                Configuration._scanner_settings_cache, 'clear') as clear:
+            Template.write([template], {'name': 'Other Product'})
+            clear.assert_not_called()
+            Template.write([template], {'lot_required': ['supplier']})
+            clear.assert_called_once_with()
+
+    def test_gs1_parse_invalid(self):
+        "Test parse GS1 barcode with invalid values"
+        for code in [
+                '17251301',
+                '17000000',
+                '37AB',
+                '3103ABCDEF',
+                '(01)1234',
+                '(17)2513',
+                '(10)%s' % ('A' * 21),
+                '(10)AB(C',
+                ]:
+            with self.subTest(code=code):
+                with self.assertRaises(gs1.GS1Error):
+                    gs1.parse(code)
+
+    def test_gs1_date_century(self):
+        "Test GS1 dates use the sliding century window"
+        today = datetime.date(2026, 1, 1)
+        for value, result in [
+                ('260101', datetime.date(2026, 1, 1)),
+                ('760101', datetime.date(2076, 1, 1)),
+                ('770101', datetime.date(1977, 1, 1)),
+                ('991200', datetime.date(1999, 12, 31)),
+                ]:
+            with self.subTest(value=value):
+                self.assertEqual(gs1._date(value, today), result)
+        self.assertEqual(
+            gs1._date('490101', datetime.date(2099, 1, 1)),
+            datetime.date(2149, 1, 1))
+
+    def test_normalize_lot_number(self):
+        "Test normalize lot number"
+        self.assertEqual(normalize_lot_number(' 00AB 12 '), 'ab12')
+
+    def test_allocate_scanned_quantity(self):
+        "Test allocate scanned quantity"
+        unit = SimpleNamespace(round=lambda q: round(q, 2))
+        moves = [SimpleNamespace(pending_quantity=q, unit=unit)
+            for q in [5, 30, 20]]
+        allocate = StockScanMixin._allocate_scanned_quantity
+
+        self.assertEqual(
+            [(moves.index(m), q) for m, q in allocate(moves, 10)],
+            [(1, 10)])
+        self.assertEqual(
+            [(moves.index(m), q) for m, q in allocate(moves, 40)],
+            [(0, 5), (1, 30), (2, 5)])
+        self.assertEqual(
+            [(moves.index(m), q) for m, q in allocate(moves, 70)],
+            [(0, 5), (1, 30), (2, 20)])
+
+    def test_lot_suggestion_key(self):
+        "Test lot suggestion key ranks by expiration then creation date"
+        lots = [
+            SimpleNamespace(id=1, expiration_date=None,
+                create_date=datetime.datetime(2024, 1, 1)),
+            SimpleNamespace(id=2, expiration_date=datetime.date(2024, 6, 1),
+                create_date=datetime.datetime(2024, 3, 1)),
+            SimpleNamespace(id=3, expiration_date=datetime.date(2024, 5, 1),
+                create_date=datetime.datetime(2024, 4, 1)),
+            SimpleNamespace(id=4, expiration_date=None,
+                create_date=datetime.datetime(2023, 1, 1)),
+            ]
+
+        self.assertEqual(
+            [l.id for l in sorted(lots, key=ShipmentOut._lot_suggestion_key)],
+            [3, 2, 4, 1])
+
+    def test_allocate_suggested_lots(self):
+        "Test allocate suggested lots"
+        product = SimpleNamespace(id=1)
+        location1, location2 = SimpleNamespace(id=1), SimpleNamespace(id=2)
+        moves = [
+            SimpleNamespace(id=i, product=product, from_location=location)
+            for i, location in [
+                (1, location1), (2, location1), (3, location1),
+                (4, location2)]]
+        lots = {product.id: [10, 20]}
+        available = {
+            (location1.id, product.id, 10): 5,
+            (location1.id, product.id, 20): 3,
+            (location2.id, product.id, 20): 1,
+            }
+
+        self.assertEqual(
+            ShipmentOut._allocate_suggested_lots(
+                list(zip(moves, [4, 2, 8, 1])), lots, available),
+            {1: 10, 2: 10, 3: 20, 4: 20})
+        self.assertEqual(available[(location1.id, product.id, 10)], -1)
+
+    def test_get_scanned_lock_ids(self):
+        "Test only the moves of the scanned products are locked"
+        product1, product2 = SimpleNamespace(id=1), SimpleNamespace(id=2)
+        shipment1 = SimpleNamespace(get_pick_moves=lambda: [
+                SimpleNamespace(id=3, product=product1),
+                SimpleNamespace(id=1, product=product2),
+                SimpleNamespace(id=-1, product=product1),
+                ])
+        shipment2 = SimpleNamespace(get_pick_moves=lambda: [
+                SimpleNamespace(id=2, product=product1),
+                ])
+
+        self.assertEqual(
+            StockScanMixin._get_scanned_lock_ids(
+                [shipment1, shipment2], {product1.id}),
+            [2, 3])
+        self.assertEqual(
+            StockScanMixin._get_scanned_lock_ids([shipment1], set()), [])
+
+    def test_get_reconcile_lots(self):
+        "Test get reconcile lots"
+        product1, product2 = SimpleNamespace(id=1), SimpleNamespace(id=2)
+        lot1, lot2, lot3 = [SimpleNamespace(id=i) for i in range(1, 4)]
+
+        def move(id, product, lot, scanned_quantity):
+            return SimpleNamespace(id=id, product=product, lot=lot,
+                scanned_quantity=scanned_quantity)
+        moves = [
+            move(1, product1, lot1, 2),
+            move(2, product1, lot1, 1),
+            move(3, product1, None, 0),
+            move(4, product2, lot2, 1),
+            move(5, product2, lot3, 1),
+            move(6, product2, None, 0),
+            move(7, product1, lot2, 0),
+            ]
+        shipment = SimpleNamespace(get_pick_moves=lambda: moves)
+
+        self.assertEqual(
+            StockScanMixin.get_reconcile_lots(shipment, moves), {3: 1})
+
+    @with_transaction()
+    def test_match_scanner_lots(self):
+        "Test match scanner lots"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Lot = pool.get('stock.lot')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name='Product', type='goods', default_uom=unit)
+        template.save()
+        product = Product(template=template)
+        product.save()
+        lot1, lot2 = Lot.create([
+                {'product': product.id, 'number': '00AB12'},
+                {'product': product.id, 'number': 'CD345-2024'},
+                ])
+
+        self.assertEqual(
+            Lot.match_scanner_lots(product, '00AB12'), [lot1])
+        self.assertEqual(
+            Lot.match_scanner_lots(product, 'ab 12', 'exact'), [])
+        self.assertEqual(
+            Lot.match_scanner_lots(product, 'ab 12', 'normalized'), [lot1])
+        self.assertEqual(
+            Lot.match_scanner_lots(product, 'CD345', 'normalized'), [])
+        self.assertEqual(
+            Lot.match_scanner_lots(product, 'CD345', 'prefix'), [lot2])
+
+        Lot.write([lot1], {'active': False})
+        self.assertEqual(
+            Lot.match_scanner_lots(product, 'ab 12', 'similarity'), [])
+
+    @with_transaction()
+    def test_prefetch_scanner_lots(self):
+        "Test the prefetched lots are served from the cache"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Lot = pool.get('stock.lot')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name='Product', type='goods', default_uom=unit)
+        template.save()
+        product = Product(template=template)
+        product.save()
+        lot1, lot2 = Lot.create([
+                {'product': product.id, 'number': 'A'},
+                {'product': product.id, 'number': 'B'},
+                ])
+        # Keep the lots of the test in the cache of the transaction
+        Lot._scanner_number_cache.clear()
+        # As if the lots were committed
+        _modified_lots.pop(Transaction(), None)
+
+        Lot.prefetch_scanner_lots([lot1, lot2])
+        # The creation of other lots keeps the cache
+        Lot.create([{'product': product.id, 'number': 'C'}])
+        hit = Lot.scanner_cache_stats()['hit']
+        with patch.object(Lot, 'search', side_effect=AssertionError):
+            self.assertEqual(Lot.get_scanner_lot(product, 'A'), lot1)
+            self.assertEqual(Lot.get_scanner_lot(product, 'B'), lot2)
+        self.assertEqual(Lot.scanner_cache_stats()['hit'], hit + 2)
+
+    @with_transaction()
+    def test_get_scanned_lot(self):
+        "Test get scanned lot uses only exact or normalized matches"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Lot = pool.get('stock.lot')
+        Config = pool.get('stock.configuration')
+        ShipmentIn = pool.get('stock.shipment.in')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name='Product', type='goods', default_uom=unit)
+        template.save()
+        product = Product(template=template)
+        product.save()
+        lot, = Lot.create([{'product': product.id, 'number': 'L10'}])
+        config = Config(1)
+        config.scanner_lot_matching = 'prefix'
+        config.save()
+
+        def scanned_lot(number):
+            shipment = ShipmentIn(scanned_product=product, scanned_lot=None,
+                scanned_lot_number=number)
+            return shipment._get_scanned_lot()
+
+        self.assertEqual(scanned_lot('l 10'), lot)
+        self.assertEqual(scanned_lot('L1'), None)
+        self.assertEqual(
+            Lot.match_scanner_lots(product, 'L1', 'prefix'), [lot])
+
+    @with_transaction()
+    def test_scanner_snapshot(self):
+        "Test the snapshot stores only the committed lots"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Lot = pool.get('stock.lot')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name='Product', type='goods', default_uom=unit)
+        template.save()
+        product = Product(template=template)
+        product.save()
+        lot, = Lot.create([{'product': product.id, 'number': 'A'}])
+
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.object(snapshot, 'path',
+                    return_value=os.path.join(directory, 'snapshot')):
+            self.assertEqual(Lot.get_scanner_lot(product, 'A'), lot)
+            self.assertEqual(snapshot.lookup(product.id, 'A'), None)
+
+            snapshot.store(product.id, 'A', lot.id)
+            self.assertEqual(snapshot.lookup(product.id, 'A'), lot.id)
+            with patch.object(snapshot, '_max_age', return_value=-1):
+                self.assertEqual(snapshot.lookup(product.id, 'A'), None)
+
+            Lot.write([lot], {'number': 'B'})
+            self.assertEqual(snapshot.lookup(product.id, 'A'), None)
+
+    @with_transaction()
+    def test_scanner_snapshot_error(self):
+        "Test the lookups fall back to the database on snapshot errors"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Lot = pool.get('stock.lot')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name='Product', type='goods', default_uom=unit)
+        template.save()
+        product = Product(template=template)
+        product.save()
+        lot, = Lot.create([{'product': product.id, 'number': 'A'}])
+
+        # A directory can not be opened as the snapshot
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.object(snapshot, 'path', return_value=directory):
+            self.assertEqual(snapshot.lookup(product.id, 'A'), None)
+            snapshot.store(product.id, 'A', lot.id)
+            snapshot.discard([lot.id])
+            self.assertEqual(Lot.get_scanner_lot(product, 'A'), lot)
+
+    @with_transaction()
+    def test_deduplicate_scanner_lots(self):
+        "Test deduplicate scanner lots merges into the oldest lot"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Lot = pool.get('stock.lot')
+        Package = pool.get('stock.scanner.lot.package')
+        PackageLine = pool.get('stock.scanner.lot.package.line')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name='Product', type='goods', default_uom=unit)
+        template.save()
+        product = Product(template=template)
+        product.save()
+        lot1, lot2, lot3, lot4, lot5 = Lot.create([
+                {'product': product.id, 'number': 'A'},
+                {'product': product.id, 'number': 'A'},
+                {'product': product.id, 'number': 'B'},
+                {'product': product.id, 'number': 'A'},
+                {'product': product.id, 'number': 'A',
+                    'scanner_always': True},
+                ])
+        package, = Package.create([{
+                    'code': 'P',
+                    'lines': [('create', [{
+                                    'product': product.id,
+                                    'lot': lot.id,
+                                    'quantity': 1,
+                                    } for lot in [lot2, lot3, lot4]])],
+                    }])
+
+        # The chunks are committed by the merge
+        with patch.object(Transaction(), 'commit'):
+            self.assertEqual(Lot.deduplicate_scanner_lots(),
+                [(product.id, 'A', lot1.id, 3)])
+
+        self.assertEqual(
+            [l.lot for l in PackageLine.search(
+                    [('package', '=', package.id)], order=[('id', 'ASC')])],
+            [lot1, lot3, lot1])
+        self.assertEqual(
+            Lot.search([], order=[('id', 'ASC')]), [lot1, lot3, lot5])
+        self.assertEqual(
+            Lot.search([('active', '=', False)], order=[('id', 'ASC')]),
+            [lot2, lot4])
+        self.assertIsNotNone(lot2.write_date)
+
+    @with_transaction()
+    def test_deduplicate_scanner_lots_dry_run(self):
+        "Test deduplicate scanner lots with dry run"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Lot = pool.get('stock.lot')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name='Product', type='goods', default_uom=unit)
+        template.save()
+        product = Product(template=template)
+        product.save()
+        lot1, lot2, lot3 = Lot.create([
+                {'product': product.id, 'number': 'A'},
+                {'product': product.id, 'number': 'A'},
+                {'product': product.id, 'number': 'B'},
+                ])
+
+        self.assertEqual(Lot.deduplicate_scanner_lots(dry_run=True),
+            [(product.id, 'A', lot1.id, 2)])
+        self.assertEqual(Lot.search([], count=True), 3)
+
+    @with_transaction()
+    def test_scanner_journal(self):
+        "Test the queued scans are replayed once on their shipment"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Party = pool.get('party.party')
+        Location = pool.get('stock.location')
+        Config = pool.get('stock.configuration')
+        ShipmentIn = pool.get('stock.shipment.in')
+        Journal = pool.get('stock.scanner.lot.journal')
+        Queue = pool.get('ir.queue')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name='Product', type='goods', default_uom=unit)
+        template.save()
+        product = Product(template=template)
+        product.save()
+        supplier, = Location.search([('code', '=', 'SUP')])
+        warehouse, = Location.search([('code', '=', 'WH')])
+        company = create_company()
+        with set_company(company):
+            party = Party(name='Supplier')
+            party.save()
+            config = Config(1)
+            config.scanner_on_shipment_in = True
+            config.scanner_lot_creation = 'search-create'
+            config.scanner_lot_queue = True
+            config.save()
+            self.assertTrue(Config.get_scanner_settings(None)['queue'])
+            shipment, = ShipmentIn.create([{
+                        'supplier': party.id,
+                        'warehouse': warehouse.id,
+                        'incoming_moves': [('create', [{
+                                        'product': product.id,
+                                        'unit': unit.id,
+                                        'quantity': 10,
+                                        'from_location': supplier.id,
+                                        'to_location': (
+                                            warehouse.input_location.id),
+                                        'unit_price': Decimal(8),
+                                        'currency': company.currency.id,
+                                        }])],
+                        }])
+
+            def summary():
+                return sorted(
+                    (m.lot.number if m.lot else '', m.scanned_quantity or 0)
+                    for m in ShipmentIn(shipment.id).incoming_moves)
+
+            shipment.scanned_product = product
+            shipment.scanned_lot_number = 'A'
+            shipment.scanned_quantity = 3
+            ShipmentIn._queue_scans([shipment])
+            entry, = Journal.search([])
+            self.assertEqual(Queue.search([], count=True), 1)
+            self.assertEqual(entry.state, 'pending')
+            self.assertEqual(entry.get_scan(), {
+                    'product': product.id,
+                    'quantity': 3,
+                    'lot_number': 'A',
+                    })
+            self.assertEqual(shipment.scanned_product, None)
+            self.assertEqual(summary(), [('', 0)])
+
+            Journal.process_shipments([entry])
+            self.assertEqual(Journal(entry.id).state, 'done')
+            self.assertEqual(summary(), [('', 0), ('A', 3)])
+
+            Journal.replay([entry])
+            self.assertEqual(summary(), [('', 0), ('A', 3)])
+
+    @with_transaction()
+    def test_lot_number_allocator_reserve(self):
+        "Test the lot numbers are reserved by blocks from the sequence"
+        pool = Pool()
+        Sequence = pool.get('ir.sequence')
+        ModelData = pool.get('ir.model.data')
+
+        sequence = Sequence(name='Lot', prefix='L',
+            sequence_type=ModelData.get_id(
+                'stock_lot', 'sequence_type_stock_lot'))
+        sequence.save()
+
+        transaction = Transaction()
+        with patch('trytond.modules.stock_scanner_lot.lot.config.getint',
+                    return_value=3), \
+                patch.object(transaction, 'new_transaction',
+                    return_value=nullcontext(transaction)), \
+                patch.object(transaction, 'commit'):
+            self.assertEqual(
+                LotNumberAllocator._reserve(sequence.id),
+                ['L1', 'L2', 'L3'])
+            self.assertEqual(
+                LotNumberAllocator._reserve(sequence.id),
+                ['L4', 'L5', 'L6'])
+
+    @with_transaction()
+    def test_lot_number_allocator(self):
+        "Test the lots created by the scans are numbered from the blocks"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Sequence = pool.get('ir.sequence')
+        ModelData = pool.get('ir.model.data')
+        Config = pool.get('stock.configuration')
+        ShipmentIn = pool.get('stock.shipment.in')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name='Product', type='goods', default_uom=unit)
+        template.save()
+        product = Product(template=template)
+        product.save()
+        sequence = Sequence(name='Lot', prefix='L',
+            sequence_type=ModelData.get_id(
+                'stock_lot', 'sequence_type_stock_lot'))
+        sequence.save()
+        company = create_company()
+        with set_company(company):
+            config = Config(1)
+            config.scanner_lot_sequence = sequence
+            config.save()
+            shipment = ShipmentIn(scanned_product=product)
+
+            blocks = iter([['L1', 'L2'], ['L3', 'L4']])
+            with patch.dict(LotNumberAllocator._blocks, clear=True), \
+                    patch.object(LotNumberAllocator, '_reserve',
+                        side_effect=lambda s: next(blocks)) as reserve:
+                self.assertEqual(
+                    [shipment._create_lot().number for _ in range(3)],
+                    ['L1', 'L2', 'L3'])
+                self.assertEqual(reserve.call_count, 2)
+                reserve.assert_called_with(sequence.id)
+
+            # The lots are numbered with the date without sequence
+            config.scanner_lot_sequence = None
+            config.save()
+            self.assertEqual(shipment._create_lot().number,
+                datetime.date.today().strftime('%Y-%m-%d'))
+
+    @with_transaction()
+    def test_scanner_lot_expiration_date(self):
+        "Test the lots created by the scans get their expiration dates"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Party = pool.get('party.party')
+        Location = pool.get('stock.location')
+        Config = pool.get('stock.configuration')
+        ShipmentIn = pool.get('stock.shipment.in')
+        Lot = pool.get('stock.lot')
+        Date = pool.get('ir.date')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name='Product', type='goods', default_uom=unit,
+            shelf_life_state='optional', shelf_life_time=10,
+            expiration_state='optional', expiration_time=5)
+        template.save()
+        product = Product(template=template)
+        product.save()
+        supplier, = Location.search([('code', '=', 'SUP')])
+        warehouse, = Location.search([('code', '=', 'WH')])
+        company = create_company()
+        with set_company(company):
+            party = Party(name='Supplier')
+            party.save()
+            config = Config(1)
+            config.scanner_on_shipment_in = True
+            config.scanner_lot_creation = 'search-create'
+            config.save()
+            shipment, = ShipmentIn.create([{
+                        'supplier': party.id,
+                        'warehouse': warehouse.id,
+                        'incoming_moves': [('create', [{
+                                        'product': product.id,
+                                        'unit': unit.id,
+                                        'quantity': 10,
+                                        'from_location': supplier.id,
+                                        'to_location': (
+                                            warehouse.input_location.id),
+                                        'unit_price': Decimal(8),
+                                        'currency': company.currency.id,
+                                        }])],
+                        }])
+            today = Date.today()
+
+            # The expiration date of the barcode is used
+            shipment.scanned_product = product
+            shipment.set_scanned_gs1(gs1.parse('(17)301231(10)A'))
+            self.assertEqual(shipment.scanned_lot_number, 'A')
+            self.assertEqual(
+                shipment.scanned_expiration_date, datetime.date(2030, 12, 31))
+            lot = shipment._create_lot()
+            self.assertEqual(lot.expiration_date, datetime.date(2030, 12, 31))
+            self.assertEqual(lot.shelf_life_expiration_date,
+                today + datetime.timedelta(days=10))
+
+            # The shelf life of the product is used without scanned date
+            shipment.scanned_expiration_date = None
+            lot = shipment._create_lot()
+            self.assertEqual(
+                lot.expiration_date, today + datetime.timedelta(days=5))
+
+            # The expiration date of a batch is used
+            ShipmentIn.scan_batch([shipment], [{
+                        'product': product.id,
+                        'quantity': 2,
+                        'lot_number': 'B',
+                        'expiration_date': datetime.date(2031, 1, 31),
+                        }])
+            lot, = Lot.search([('number', '=', 'B')])
+            self.assertEqual(lot.expiration_date, datetime.date(2031, 1, 31))
+
+        table = Lot.__table__()
+        self.assertIn(
+            Index(
+                table,
+                (table.product, Index.Equality()),
+                (table.expiration_date, Index.Range())),
+            Lot._sql_indexes)
+
+    @with_transaction()
+    def test_scanner_journal_error(self):
+        "Test the failed replays set the entries in error"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Party = pool.get('party.party')
+        Location = pool.get('stock.location')
+        ShipmentIn = pool.get('stock.shipment.in')
+        Journal = pool.get('stock.scanner.lot.journal')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name='Product', type='goods', default_uom=unit)
+        template.save()
+        product = Product(template=template)
+        product.save()
+        warehouse, = Location.search([('code', '=', 'WH')])
+        company = create_company()
+        with set_company(company):
+            party = Party(name='Supplier')
+            party.save()
+            shipment, = ShipmentIn.create([{
+                        'supplier': party.id,
+                        'warehouse': warehouse.id,
+                        }])
+            entry, = Journal.create([{
+                        'shipment': str(shipment),
+                        'product': product.id,
+                        'quantity': 1,
+                        }])
+
+            # The rollback would drop the records of the test
+            with patch.object(Journal, 'replay',
+                        side_effect=UserError("Lot required")), \
+                    patch.object(Transaction(), 'rollback'):
+                Journal.process_shipments([entry])
+            entry = Journal(entry.id)
+            self.assertEqual(entry.state, 'error')
+            self.assertEqual(entry.error_message, "Lot required")
+            self.assertEqual(
+                ShipmentIn(shipment.id).scanner_errors, (entry,))
+
+            Journal.retry([entry])
+            entry = Journal(entry.id)
+            self.assertEqual(entry.state, 'pending')
+            self.assertEqual(entry.error_message, None)
+
+    @with_transaction()
+    def test_scanner_package(self):
+        "Test scanner package"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Lot = pool.get('stock.lot')
+        Package = pool.get('stock.scanner.lot.package')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name='Product', type='goods', default_uom=unit)
+        template.save()
+        product = Product(template=template)
+        product.save()
+        lot = Lot(product=product, number='A')
+        lot.save()
+        package, = Package.create([{
+                    'code': '376104250021234569',
+                    'lines': [('create', [{
+                                    'product': product.id,
+                                    'lot': lot.id,
+                                    'quantity': 10,
+                                    }, {
+                                    'product': product.id,
+                                    'lot_number': 'B',
+                                    'quantity': 5,
+                                    }])],
+                    }])
+
+        self.assertEqual(
+            Package.get_scanner_package('376104250021234569'), package)
+        self.assertEqual(Package.get_scanner_package('unknown'), None)
+        self.assertEqual(package.get_scans(), [
+                {'product': product.id, 'quantity': 10, 'lot': lot.id},
+                {'product': product.id, 'quantity': 5, 'lot_number': 'B'},
+                ])
+        self.assertEqual(
+            gs1.parse('00376104250021234569')['sscc'], '376104250021234569')
 
 
 del ModuleTestCase
@@ -0,0 +1,107 @@
+import unittest
+from decimal import Decimal
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install Stock Scanner Lot Module
+        config = activate_modules('stock_scanner_lot')
+
+        # Create company
+        _ = create_company()
+
+        # Reload the context
+        User = Model.get('res.user')
+        config._context = User.get_preferences(True, config.context)
+
+        # Create product
+        ProductUom = Model.get('product.uom')
+        ProductTemplate = Model.get('product.template')
+        unit, = ProductUom.find([('name', '=', 'Unit')])
+        template = ProductTemplate()
+        template.name = 'Product'
+        template.default_uom = unit
+        template.type = 'goods'
+        template.list_price = Decimal('20')
+        template.save()
+        product, = template.products
+
+        # Create a lot
+        Lot = Model.get('stock.lot')
+        lot = Lot(number='A', product=product)
+        lot.save()
+
+        # Create an inventory with a line of the lot
+        Location = Model.get('stock.location')
+        Inventory = Model.get('stock.inventory')
+        storage, = Location.find([('code', '=', 'STO')])
+        inventory = Inventory(location=storage)
+        line = inventory.lines.new()
+        line.product = product
+        line.lot = lot
+        line.quantity = 1
+        inventory.save()
+
+        # Scan the existing lot
+        inventory.scanned_product = product
+        inventory.scanned_lot_number = 'A'
+        self.assertEqual(inventory.scanned_lot, lot)
+        inventory.scanned_quantity = 2
+        inventory.click('scan')
+        self.assertEqual(inventory.scanned_product, None)
+        self.assertEqual(len(inventory.lines), 1)
+        self.assertEqual(inventory.lines[0].quantity, 3)
+
+        # Configure stock to create the missing lots
+        StockConfig = Model.get('stock.configuration')
+        stock_config = StockConfig(1)
+        stock_config.scanner_lot_creation = 'search-create'
+        stock_config.save()
+
+        # Scan a batch with a new lot and the existing one
+        Inventory.scan_batch([inventory.id], [
+                {'product': product.id, 'quantity': 4, 'lot_number': 'B'},
+                {'product': product.id, 'quantity': 1, 'lot': lot.id},
+                {'product': product.id, 'quantity': 1, 'lot_number': 'B'},
+                ], config.context)
+        inventory.reload()
+        self.assertEqual(
+            sorted((l.lot.number, l.quantity) for l in inventory.lines),
+            [('A', 4), ('B', 5)])
+        self.assertEqual(len(Lot.find([('number', '=', 'B')])), 1)
+
+        # The lot numbers are matched with the lot matching
+        stock_config.scanner_lot_matching = 'normalized'
+        stock_config.save()
+        inventory.scanned_product = product
+        inventory.scanned_lot_number = ' a'
+        self.assertEqual(inventory.scanned_lot, lot)
+
+        # The missing lots are not created without lot creation
+        stock_config.scanner_lot_creation = None
+        stock_config.save()
+        Inventory.scan_batch([inventory.id], [
+                {'product': product.id, 'quantity': 2, 'lot_number': 'C'},
+                {'product': product.id, 'quantity': 1, 'lot_number': '0a'},
+                ], config.context)
+        inventory.reload()
+        self.assertEqual(
+            sorted((l.lot.number if l.lot else '', l.quantity)
+                for l in inventory.lines),
+            [('', 2), ('A', 5), ('B', 5)])
+        self.assertEqual(Lot.find([('number', '=', 'C')]), [])
@@ -0,0 +1,129 @@
+import unittest
+from decimal import Decimal
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company, get_company
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install Stock Scanner Lot Module
+        config = activate_modules('stock_scanner_lot')
+
+        # Create company
+        _ = create_company()
+        company = get_company()
+
+        # Reload the context
+        User = Model.get('res.user')
+        config._context = User.get_preferences(True, config.context)
+
+        # Create supplier
+        Party = Model.get('party.party')
+        supplier = Party(name='supplier')
+        supplier.save()
+
+        # Create product
+        ProductUom = Model.get('product.uom')
+        ProductTemplate = Model.get('product.template')
+        unit, = ProductUom.find([('name', '=', 'Unit')])
+        template = ProductTemplate()
+        template.name = 'Product'
+        template.default_uom = unit
+        template.type = 'goods'
+        template.list_price = Decimal('20')
+        template.save()
+        product, = template.products
+
+        # Configure stock to process the scans in the queue
+        StockConfig = Model.get('stock.configuration')
+        stock_config = StockConfig(1)
+        stock_config.scanner_on_shipment_in = True
+        stock_config.scanner_lot_creation = 'search-create'
+        stock_config.scanner_lot_queue = True
+        stock_config.save()
+
+        # Create three shipments
+        Location = Model.get('stock.location')
+        ShipmentIn = Model.get('stock.shipment.in')
+        supplier_loc, = Location.find([('code', '=', 'SUP')])
+        shipments = []
+        for _ in range(3):
+            shipment_in = ShipmentIn()
+            shipment_in.supplier = supplier
+            move = shipment_in.incoming_moves.new()
+            move.product = product
+            move.unit = unit
+            move.quantity = 10
+            move.from_location = supplier_loc
+            move.to_location = shipment_in.warehouse.input_location
+            move.unit_price = Decimal('8')
+            move.currency = company.currency
+            shipment_in.save()
+            shipments.append(shipment_in)
+        shipment1, shipment2, shipment3 = shipments
+
+        scans = [
+            {'product': product.id, 'quantity': 1.0, 'lot_number': 'A'},
+            {'product': product.id, 'quantity': 2.0, 'lot_number': 'B'},
+            {'product': product.id, 'quantity': 1.0, 'lot_number': 'A'},
+            ]
+
+        # The scans are stored in the journal
+        Journal = Model.get('stock.scanner.lot.journal')
+        for scan in scans:
+            shipment1.scanned_product = product
+            shipment1.scanned_quantity = scan['quantity']
+            shipment1.scanned_lot_number = scan['lot_number']
+            shipment1.click('scan')
+        self.assertEqual(shipment1.scanned_product, None)
+        self.assertEqual(len(shipment1.incoming_moves), 1)
+        self.assertEqual(
+            [(e.lot_number, e.quantity, e.state) for e in Journal.find([])],
+            [('A', 1.0, 'pending'), ('B', 2.0, 'pending'),
+                ('A', 1.0, 'pending')])
+
+        # Process the journal with the scheduled action
+        Cron = Model.get('ir.cron')
+        cron, = Cron.find([
+                ('method', '=', 'stock.scanner.lot.journal|process_journal'),
+                ])
+        cron.click('run_once')
+        self.assertEqual(
+            {e.state for e in Journal.find([])}, {'done'})
+
+        # The replay gives the same moves as the direct scans
+        ShipmentIn.scan_batch([shipment2.id], scans, config.context)
+
+        def summary(shipment):
+            shipment.reload()
+            return sorted((m.lot.number if m.lot else '', m.quantity,
+                    m.scanned_quantity or 0.0)
+                for m in shipment.incoming_moves)
+
+        self.assertEqual(summary(shipment1), summary(shipment2))
+        self.assertEqual(
+            sum(m.scanned_quantity or 0.0
+                for m in shipment1.incoming_moves), 4.0)
+
+        # Deleting a shipment deletes its pending scans
+        shipment3.scanned_product = product
+        shipment3.scanned_quantity = 1.0
+        shipment3.click('scan')
+        self.assertEqual(
+            len(Journal.find([('state', '=', 'pending')])), 1)
+        shipment3.delete()
+        self.assertEqual(Journal.find([('state', '=', 'pending')]), [])
+        self.assertEqual(len(Journal.find([])), 3)
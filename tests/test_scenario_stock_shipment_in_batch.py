@@ -0,0 +1,177 @@
+import unittest
+from decimal import Decimal
+
+from proteus import Model
+from trytond.modules.account.tests.tools import (create_chart,
+                                                 create_fiscalyear,
+                                                 get_accounts)
+from trytond.modules.account_invoice.tests.tools import (
+    create_payment_term, set_fiscalyear_invoice_sequences)
+from trytond.modules.company.tests.tools import create_company, get_company
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install Stock Scanner Lot Module
+        config = activate_modules('stock_scanner_lot')
+
+        # Create company
+        _ = create_company()
+        company = get_company()
+
+        # Reload the context
+        User = Model.get('res.user')
+        config._context = User.get_preferences(True, config.context)
+
+        # Create fiscal year
+        fiscalyear = set_fiscalyear_invoice_sequences(
+            create_fiscalyear(company))
+        fiscalyear.click('create_period')
+
+        # Create chart of accounts
+        _ = create_chart(company)
+        accounts = get_accounts(company)
+        revenue = accounts['revenue']
+        expense = accounts['expense']
+
+        # Create supplier
+        Party = Model.get('party.party')
+        supplier = Party(name='supplier')
+        supplier.save()
+
+        # Create category
+        ProductCategory = Model.get('product.category')
+        account_category = ProductCategory(name='Category')
+        account_category.accounting = True
+        account_category.account_expense = expense
+        account_category.account_revenue = revenue
+        account_category.save()
+
+        # Create product
+        ProductUom = Model.get('product.uom')
+        ProductTemplate = Model.get('product.template')
+        Product = Model.get('product.product')
+        unit, = ProductUom.find([('name', '=', 'Unit')])
+        product = Product()
+        template = ProductTemplate()
+        template.name = 'Product'
+        template.account_category = account_category
+        template.default_uom = unit
+        template.type = 'goods'
+        template.list_price = Decimal('20')
+        template.cost_price = Decimal('8')
+        template.purchasable = True
+        template.lot_required = ['supplier']
+        template.save()
+        product.template = template
+        product.save()
+
+        # Configure stock
+        StockConfig = Model.get('stock.configuration')
+        stock_config = StockConfig(1)
+        stock_config.scanner_on_shipment_in = True
+        stock_config.scanner_lot_creation = 'search-create'
+        stock_config.save()
+
+        # Create payment term
+        payment_term = create_payment_term()
+        payment_term.save()
+
+        # Create two shipments from two purchases
+        Purchase = Model.get('purchase.purchase')
+        Move = Model.get('stock.move')
+        ShipmentIn = Model.get('stock.shipment.in')
+        shipments = []
+        for _ in range(2):
+            purchase = Purchase()
+            purchase.party = supplier
+            purchase.payment_term = payment_term
+            purchase_line = purchase.lines.new()
+            purchase_line.product = product
+            purchase_line.quantity = 10
+            purchase_line.unit_price = product.cost_price
+            purchase.save()
+            purchase.click('quote')
+            purchase.click('confirm')
+            purchase.click('process')
+            shipment_in = ShipmentIn()
+            shipment_in.supplier = supplier
+            for move in purchase.moves:
+                shipment_in.incoming_moves.append(Move(id=move.id))
+            shipment_in.save()
+            shipments.append(shipment_in)
+        shipment1, shipment2 = shipments
+
+        scans = [
+            {'product': product.id, 'quantity': 1.0, 'lot_number': 'A'},
+            {'product': product.id, 'quantity': 2.0, 'lot_number': 'B'},
+            {'product': product.id, 'quantity': 1.0, 'lot_number': 'A'},
+            {'product': product.id, 'quantity': 3.0, 'lot_number': 'C'},
+            ]
+
+        # Scan one by one on the first shipment
+        Lot = Model.get('stock.lot')
+        for scan in scans:
+            shipment1.scanned_product = product
+            shipment1.scanned_quantity = scan['quantity']
+            shipment1.scanned_lot_number = scan['lot_number']
+            lots = Lot.find([
+                    ('number', '=', scan['lot_number']),
+                    ('product', '=', product.id),
+                    ])
+            if lots:
+                shipment1.scanned_lot = lots[0]
+            shipment1.click('scan')
+
+        # Scan all at once on the second shipment
+        ShipmentIn.scan_batch([shipment2.id], scans, config.context)
+        shipment2.reload()
+
+        def summary(shipment):
+            return sorted((m.lot.number if m.lot else '', m.quantity,
+                    m.scanned_quantity or 0.0)
+                for m in shipment.incoming_moves)
+
+        self.assertEqual(summary(shipment1), summary(shipment2))
+        self.assertEqual(len(shipment2.pending_moves), 1)
+        self.assertEqual(shipment2.pending_moves[0].pending_quantity, 3.0)
+        self.assertEqual(shipment2.scanned_product, None)
+        self.assertEqual(
+            sorted(l.number for l in Lot.find([])), ['A', 'B', 'C'])
+
+        # The totals are the same whatever the scanning method
+        def totals(shipment):
+            shipment.reload()
+            return sorted((t.lot.number if t.lot else '', t.quantity,
+                    t.scanned_quantity, t.pending_quantity)
+                for t in shipment.scanner_totals)
+
+        self.assertEqual(totals(shipment1), totals(shipment2))
+        self.assertEqual(
+            sum(t.scanned_quantity for t in shipment2.scanner_totals), 7.0)
+
+        # Reconcile keeps the move which was not scanned
+        discrepancies, = ShipmentIn.get_scanner_discrepancies(
+            [shipment2.id], config.context)
+        self.assertEqual(
+            [(d['lot'], d['quantity'], d['scanned_quantity'])
+                for d in discrepancies],
+            [(None, 3.0, 0.0)])
+        shipment2.click('reconcile_scanned_moves')
+        self.assertEqual(len(shipment2.incoming_moves), 4)
+        self.assertEqual(summary(shipment2), summary(shipment1))
+        self.assertEqual(
+            ShipmentIn.get_scanner_discrepancies(
+                [shipment2.id], config.context), [discrepancies])
@@ -0,0 +1,124 @@
+import unittest
+from decimal import Decimal
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company, get_company
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install Stock Scanner Lot Module
+        config = activate_modules('stock_scanner_lot')
+
+        # Create company
+        _ = create_company()
+        company = get_company()
+
+        # Reload the context
+        User = Model.get('res.user')
+        config._context = User.get_preferences(True, config.context)
+
+        # Create supplier
+        Party = Model.get('party.party')
+        supplier = Party(name='supplier')
+        supplier.save()
+
+        # Create product
+        ProductUom = Model.get('product.uom')
+        ProductTemplate = Model.get('product.template')
+        unit, = ProductUom.find([('name', '=', 'Unit')])
+        template = ProductTemplate()
+        template.name = 'Product'
+        template.default_uom = unit
+        template.type = 'goods'
+        template.list_price = Decimal('20')
+        template.lot_required = ['supplier']
+        template.save()
+        product, = template.products
+
+        # Configure stock to consolidate the scanned moves
+        StockConfig = Model.get('stock.configuration')
+        stock_config = StockConfig(1)
+        stock_config.scanner_on_shipment_in = True
+        stock_config.scanner_lot_creation = 'search-create'
+        stock_config.scanner_lot_consolidate = True
+        stock_config.save()
+
+        # Create a shipment
+        Location = Model.get('stock.location')
+        ShipmentIn = Model.get('stock.shipment.in')
+        supplier_loc, = Location.find([('code', '=', 'SUP')])
+
+        def create_shipment(*lines):
+            shipment_in = ShipmentIn()
+            shipment_in.supplier = supplier
+            for quantity, lot in lines:
+                move = shipment_in.incoming_moves.new()
+                move.product = product
+                move.unit = unit
+                move.quantity = quantity
+                move.lot = lot
+                move.from_location = supplier_loc
+                move.to_location = shipment_in.warehouse.input_location
+                move.unit_price = Decimal('8')
+                move.currency = company.currency
+            shipment_in.save()
+            return shipment_in
+
+        shipment_in = create_shipment((10, None))
+
+        # The scans of the same lot keep one move
+        for number in ['A', 'B', 'A', 'A']:
+            shipment_in.scanned_product = product
+            shipment_in.scanned_quantity = 1.0
+            shipment_in.scanned_lot_number = number
+            shipment_in.click('scan')
+
+        def summary(shipment):
+            shipment.reload()
+            return sorted((m.lot.number if m.lot else '', m.quantity,
+                    m.scanned_quantity or 0.0)
+                for m in shipment.incoming_moves)
+
+        self.assertEqual(summary(shipment_in), [
+                ('', 6.0, 0.0), ('A', 3.0, 3.0), ('B', 1.0, 1.0)])
+
+        # Compact the moves split by hand
+        Lot = Model.get('stock.lot')
+        lot_a, = Lot.find([('number', '=', 'A')])
+        lot_b, = Lot.find([('number', '=', 'B')])
+        shipment_in = create_shipment(
+            (2, lot_a), (3, lot_b), (2, lot_a), (1, lot_a))
+        self.assertEqual(len(shipment_in.incoming_moves), 4)
+        shipment_in.click('compact_scanned_moves')
+        self.assertEqual(summary(shipment_in), [
+                ('A', 5.0, 0.0), ('B', 3.0, 0.0)])
+
+        # The totals follow the compaction and the manual edits
+        def totals(shipment):
+            shipment.reload()
+            return sorted((t.lot.number if t.lot else '', t.quantity,
+                    t.scanned_quantity, t.pending_quantity)
+                for t in shipment.scanner_totals)
+
+        self.assertEqual(totals(shipment_in), [
+                ('A', 5.0, 0.0, 5.0), ('B', 3.0, 0.0, 3.0)])
+        move = [m for m in shipment_in.incoming_moves if m.lot == lot_b][0]
+        move.quantity = 4
+        move.save()
+        self.assertEqual(totals(shipment_in), [
+                ('A', 5.0, 0.0, 5.0), ('B', 4.0, 0.0, 4.0)])
+        move.delete()
+        self.assertEqual(totals(shipment_in), [('A', 5.0, 0.0, 5.0)])
@@ -0,0 +1,146 @@
+import unittest
+from decimal import Decimal
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company, get_company
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install Stock Scanner Lot Module
+        config = activate_modules('stock_scanner_lot')
+
+        # Create company
+        _ = create_company()
+        company = get_company()
+
+        # Reload the context
+        User = Model.get('res.user')
+        config._context = User.get_preferences(True, config.context)
+
+        # Create supplier
+        Party = Model.get('party.party')
+        supplier = Party(name='supplier')
+        supplier.save()
+
+        # Create product
+        ProductUom = Model.get('product.uom')
+        ProductTemplate = Model.get('product.template')
+        unit, = ProductUom.find([('name', '=', 'Unit')])
+        template = ProductTemplate()
+        template.name = 'Product'
+        template.default_uom = unit
+        template.type = 'goods'
+        template.list_price = Decimal('20')
+        template.save()
+        product, = template.products
+
+        # Create a lot
+        Lot = Model.get('stock.lot')
+        lot = Lot(number='A', product=product)
+        lot.save()
+
+        # Configure stock
+        StockConfig = Model.get('stock.configuration')
+        stock_config = StockConfig(1)
+        stock_config.scanner_on_shipment_in = True
+        stock_config.scanner_lot_creation = 'search-create'
+        stock_config.save()
+
+        # Create two packages with the same content
+        Package = Model.get('stock.scanner.lot.package')
+
+        def create_package(code):
+            package = Package(code=code)
+            line = package.lines.new()
+            line.product = product
+            line.lot = lot
+            line.quantity = 3
+            line = package.lines.new()
+            line.product = product
+            line.lot_number = 'B'
+            line.quantity = 2
+            package.save()
+            return package
+
+        package1 = create_package('376104250021234569')
+        package2 = create_package('376104250021234576')
+
+        # Create two shipments
+        Location = Model.get('stock.location')
+        ShipmentIn = Model.get('stock.shipment.in')
+        supplier_loc, = Location.find([('code', '=', 'SUP')])
+
+        def create_shipment():
+            shipment_in = ShipmentIn()
+            shipment_in.supplier = supplier
+            move = shipment_in.incoming_moves.new()
+            move.product = product
+            move.unit = unit
+            move.quantity = 10
+            move.from_location = supplier_loc
+            move.to_location = shipment_in.warehouse.input_location
+            move.unit_price = Decimal('8')
+            move.currency = company.currency
+            shipment_in.save()
+            return shipment_in
+
+        shipment1 = create_shipment()
+        shipment2 = create_shipment()
+
+        def summary(shipment):
+            shipment.reload()
+            return sorted((m.lot.number if m.lot else '', m.quantity,
+                    m.scanned_quantity or 0.0)
+                for m in shipment.incoming_moves)
+
+        # Scan the whole content of a package
+        shipment1.scanned_package = package1
+        shipment1.click('scan')
+        self.assertEqual(shipment1.scanned_package, None)
+        self.assertEqual(summary(shipment1), [
+                ('', 5.0, 0.0), ('A', 3.0, 3.0), ('B', 2.0, 2.0)])
+        package1.reload()
+        self.assertEqual(package1.shipment, shipment1)
+
+        # A scanned package can not be scanned again
+        shipment2.scanned_barcode = '(00)376104250021234569'
+        self.assertEqual(shipment2.scanned_package, None)
+
+        # The package is stored in the journal with the queue
+        stock_config.scanner_lot_queue = True
+        stock_config.save()
+        Journal = Model.get('stock.scanner.lot.journal')
+        shipment2.scanned_barcode = '(00)376104250021234576'
+        self.assertEqual(shipment2.scanned_package, package2)
+        shipment2.click('scan')
+        self.assertEqual(shipment2.scanned_package, None)
+        package2.reload()
+        self.assertEqual(package2.shipment, shipment2)
+        self.assertEqual(
+            [(e.lot, e.lot_number, e.quantity, e.state)
+                for e in Journal.find([
+                    ('shipment', '=', 'stock.shipment.in,%s' % shipment2.id),
+                    ])],
+            [(lot, None, 3.0, 'pending'), (None, 'B', 2.0, 'pending')])
+        self.assertEqual(summary(shipment2), [('', 10.0, 0.0)])
+
+        # The processing of the journal scans the content
+        Cron = Model.get('ir.cron')
+        cron, = Cron.find([
+                ('method', '=', 'stock.scanner.lot.journal|process_journal'),
+                ])
+        cron.click('run_once')
+        self.assertEqual(summary(shipment2), summary(shipment1))
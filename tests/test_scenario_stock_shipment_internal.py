@@ -0,0 +1,110 @@
+import unittest
+from decimal import Decimal
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install Stock Scanner Lot Module
+        config = activate_modules('stock_scanner_lot')
+
+        # Create company
+        _ = create_company()
+
+        # Reload the context
+        User = Model.get('res.user')
+        config._context = User.get_preferences(True, config.context)
+
+        # Create supplier
+        Party = Model.get('party.party')
+        supplier = Party(name='supplier')
+        supplier.save()
+
+        # Create product
+        ProductUom = Model.get('product.uom')
+        ProductTemplate = Model.get('product.template')
+        unit, = ProductUom.find([('name', '=', 'Unit')])
+        template = ProductTemplate()
+        template.name = 'Product'
+        template.default_uom = unit
+        template.type = 'goods'
+        template.list_price = Decimal('20')
+        template.save()
+        product, = template.products
+
+        # Create a lot
+        Lot = Model.get('stock.lot')
+        lot = Lot(number='A', product=product)
+        lot.save()
+
+        # Configure stock
+        StockConfig = Model.get('stock.configuration')
+        stock_config = StockConfig(1)
+        stock_config.scanner_on_shipment_internal = True
+        stock_config.scanner_on_shipment_in_return = True
+        stock_config.save()
+
+        # Get locations
+        Location = Model.get('stock.location')
+        supplier_loc, = Location.find([('code', '=', 'SUP')])
+        storage_loc, = Location.find([('code', '=', 'STO')])
+        internal_loc = Location(
+            name='Internal', type='storage', parent=storage_loc)
+        internal_loc.save()
+
+        def scan(shipment):
+            shipment.scanned_product = product
+            shipment.scanned_quantity = 2.0
+            shipment.scanned_lot_number = 'A'
+            self.assertEqual(shipment.scanned_lot, lot)
+            shipment.click('scan')
+            self.assertEqual(shipment.scanned_product, None)
+            shipment.reload()
+            return sorted((m.lot.number if m.lot else '', m.quantity,
+                    m.scanned_quantity or 0.0)
+                for m in shipment.moves)
+
+        # Scan a lot on an internal shipment
+        ShipmentInternal = Model.get('stock.shipment.internal')
+        shipment = ShipmentInternal()
+        shipment.from_location = storage_loc
+        shipment.to_location = internal_loc
+        move = shipment.moves.new()
+        move.product = product
+        move.unit = unit
+        move.quantity = 5
+        move.from_location = storage_loc
+        move.to_location = internal_loc
+        shipment.save()
+        self.assertEqual(
+            scan(shipment), [('', 3.0, 0.0), ('A', 2.0, 2.0)])
+
+        # Scan a lot on a supplier return
+        ShipmentInReturn = Model.get('stock.shipment.in.return')
+        shipment = ShipmentInReturn()
+        shipment.supplier = supplier
+        shipment.from_location = storage_loc
+        shipment.to_location = supplier_loc
+        move = shipment.moves.new()
+        move.product = product
+        move.unit = unit
+        move.quantity = 5
+        move.from_location = storage_loc
+        move.to_location = supplier_loc
+        shipment.save()
+        self.assertEqual(
+            scan(shipment), [('', 3.0, 0.0), ('A', 2.0, 2.0)])
@@ -0,0 +1,97 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from collections import defaultdict
+
+from trytond.model import Index, ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.tools import reduce_ids
+from trytond.transaction import Transaction, without_check_access
+
+
+class ScannerLotTotal(ModelSQL, ModelView):
+    'Stock Scanner Lot Total'
+    __name__ = 'stock.scanner.lot.total'
+
+    shipment = fields.Reference('Shipment', selection='get_shipments',
+        required=True, readonly=True)
+    product = fields.Many2One('product.product', 'Product', required=True,
+        readonly=True)
+    lot = fields.Many2One('stock.lot', 'Lot', readonly=True)
+    unit = fields.Many2One('product.uom', 'Unit', required=True,
+        readonly=True)
+    quantity = fields.Float('Quantity', digits='unit', required=True,
+        readonly=True)
+    scanned_quantity = fields.Float('Scanned Quantity', digits='unit',
+        required=True, readonly=True)
+    pending_quantity = fields.Float('Pending Quantity', digits='unit',
+        required=True, readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(ScannerLotTotal, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(
+                    t,
+                    (t.shipment, Index.Equality()),
+                    (t.product, Index.Equality())),
+                })
+        cls._order.insert(0, ('product', 'ASC'))
+
+    @classmethod
+    def get_shipments(cls):
+        pool = Pool()
+        Journal = pool.get('stock.scanner.lot.journal')
+        return Journal.get_shipments()
+
+    @classmethod
+    @without_check_access
+    def update_shipment(cls, shipment, moves, products=None):
+        '''
+        Replace the totals of the products of the shipment by the ones
+        computed from the moves.
+
+        Only the totals of the products are replaced when they are given so
+        the totals of a scan are updated with a single delete and create.
+        The totals are kept in sync by the moves of the shipments.
+        '''
+        if products is not None:
+            products = set(products)
+            if not products:
+                return
+        totals = defaultdict(lambda: [0, 0, 0])
+        units = {}
+        for move in moves:
+            if products is not None and move.product not in products:
+                continue
+            key = (move.product, move.lot)
+            scanned = move.scanned_quantity or 0
+            total = totals[key]
+            total[0] += move.quantity
+            total[1] += scanned
+            total[2] += max(move.quantity - scanned, 0)
+            units.setdefault(key, move.unit)
+
+        # The totals are only linked to the shipment so they are deleted
+        # without searching them first
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        where = table.shipment == str(shipment)
+        if products is not None:
+            where &= reduce_ids(table.product, [p.id for p in products])
+        cursor.execute(*table.delete(where=where))
+        to_save = []
+        for (product, lot), (quantity, scanned, pending) in totals.items():
+            unit = units[(product, lot)]
+            to_save.append(cls(
+                    shipment=shipment, product=product, lot=lot, unit=unit,
+                    quantity=unit.round(quantity),
+                    scanned_quantity=unit.round(scanned),
+                    pending_quantity=unit.round(pending)))
+        cls.save(to_save)
+
+    @classmethod
+    def refresh(cls, shipments):
+        "Compute again all the totals of the shipments from their moves"
+        for shipment in shipments:
+            cls.update_shipment(shipment, shipment.get_pick_moves())